@@ -1,2 +1,3 @@
 from publisher import AMQPublisher
 from publisher import AMQFactory
+from replication import AMQPReplicationTransport
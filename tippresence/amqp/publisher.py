@@ -3,6 +3,7 @@
 import json
 
 from twisted.internet import defer, protocol
+from twisted.python import log
 
 from pkg_resources import resource_filename
 
@@ -20,7 +21,7 @@ class AMQPublisher(object):
     routing_key = 'presence_changes'
 
     def __init__(self, factory, presence_service):
-        presence_service.watch(self.statusChanged)
+        presence_service.subscribe(self.statusChanged, name='amqp')
         self.factory = factory
 
     @defer.inlineCallbacks
@@ -38,14 +39,25 @@ class AMQFactory(protocol.ReconnectingClientFactory):
         self.creds = creds
         self.client = None
         self.channel  = None
+        self._on_connected = []
 
     def buildProtocol(self, addr):
         self.resetDelay()
         delegate = TwistedDelegate()
         self.client = AMQClient(delegate=delegate, vhost=self.VHOST, spec=self.spec)
-        self.client.start(self.creds)
+        self.channel = None
+        d = self.client.start(self.creds)
+        d.addCallback(self._connected)
         return self.client
 
+    def addCallbackOnConnected(self, callback, *args, **kwargs):
+        self._on_connected.append((callback, args, kwargs))
+
+    def _connected(self, _):
+        for callback, args, kwargs in self._on_connected:
+            d = defer.maybeDeferred(callback, *args, **kwargs)
+            d.addErrback(log.err)
+
     @defer.inlineCallbacks
     def publish(self, exchange, msg, routing_key):
         if not self.client:
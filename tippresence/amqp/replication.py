@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from twisted.internet import defer
+from twisted.python import log
+
+class AMQPReplicationTransport(object):
+    """
+    Replication transport over fanout exchange of AMQFactory's broker.
+    Every node consumes from its own exclusive queue bound to the exchange.
+    """
+    exchange_name = 'presence_replication'
+    channel_id = 2
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.replicator = None
+
+    def start(self, replicator):
+        self.replicator = replicator
+        self.factory.addCallbackOnConnected(self._consume)
+
+    def send(self, msg):
+        return self.factory.publish(self.exchange_name, msg, '')
+
+    @defer.inlineCallbacks
+    def _consume(self):
+        client = self.factory.client
+        channel = yield client.channel(self.channel_id)
+        yield channel.channel_open()
+        yield channel.exchange_declare(exchange=self.exchange_name, type='fanout')
+        reply = yield channel.queue_declare(exclusive=True, auto_delete=True)
+        yield channel.queue_bind(queue=reply.queue, exchange=self.exchange_name)
+        reply = yield channel.basic_consume(queue=reply.queue, no_ack=True)
+        queue = yield client.queue(reply.consumer_tag)
+        msgs = yield self.replicator.snapshot()
+        for msg in msgs:
+            yield self.send(msg)
+        log.msg("AMQP replication started: %d statuses sent" % len(msgs))
+        while True:
+            msg = yield queue.get()
+            self.replicator.messageReceived(msg.content.body)
+
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import marshal
+import struct
+
+from twisted.python import log
+
+MAGIC = 'TPCAP1\n'
+RECORD_HEADER = struct.Struct('!dBI')
+
+HTTP_PUT = 1
+HTTP_REMOVE = 2
+HTTP_GET = 3
+HTTP_DUMP = 4
+SIP_PUBLISH = 5
+SIP_SUBSCRIBE = 6
+HTTP_PUT_LIST = 7
+HTTP_REMOVE_LIST = 8
+
+EVENT_NAMES = {
+        HTTP_PUT: 'http_put',
+        HTTP_REMOVE: 'http_remove',
+        HTTP_GET: 'http_get',
+        HTTP_DUMP: 'http_dump',
+        SIP_PUBLISH: 'sip_publish',
+        SIP_SUBSCRIBE: 'sip_subscribe',
+        HTTP_PUT_LIST: 'http_put_list',
+        HTTP_REMOVE_LIST: 'http_remove_list',
+        }
+
+class CaptureError(Exception):
+    pass
+
+class Recorder(object):
+    """
+    Writes presence operations to capture file. Every record is header
+    (timestamp, event, payload length) followed by marshalled tuple of
+    event fields:
+
+        HTTP_PUT        resource, tag (requested one if PUT failed),
+                        presence document, expires, priority
+        HTTP_REMOVE     resource, tag
+        HTTP_GET        resource
+        HTTP_DUMP
+        SIP_PUBLISH     resource, SIP-If-Match tag, SIP-ETag tag (empty if
+                        PUBLISH failed), expires, pidf
+        SIP_SUBSCRIBE   watcher, resource (empty for in-dialog SUBSCRIBE), expires
+        HTTP_PUT_LIST   list URI, resources
+        HTTP_REMOVE_LIST list URI
+
+    Timestamps are taken from clock of PresenceService.
+    """
+    def __init__(self):
+        self.path = None
+        self.records = 0
+        self._file = None
+
+    def recording(self):
+        return self._file is not None
+
+    def start(self, path):
+        if self._file:
+            raise CaptureError("Capture is already started: %s" % self.path)
+        self._file = open(path, 'ab')
+        if not self._file.tell():
+            self._file.write(MAGIC)
+        self.path = path
+        self.records = 0
+        log.msg("Capture of presence operations started: %s" % path)
+
+    def stop(self):
+        if not self._file:
+            return
+        self._file.close()
+        self._file = None
+        log.msg("Capture of presence operations stopped: %d records written to %s" % (self.records, self.path))
+
+    def record(self, event, timestamp, *fields):
+        if not self._file:
+            return
+        payload = marshal.dumps(fields)
+        self._file.write(RECORD_HEADER.pack(timestamp, event, len(payload)))
+        self._file.write(payload)
+        self.records += 1
+
+def read_capture(path):
+    """
+    Generate (timestamp, event, fields) records of capture file.
+    """
+    f = open(path, 'rb')
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise CaptureError("Not a capture file: %s" % path)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                break
+            if len(header) < RECORD_HEADER.size:
+                raise CaptureError("Truncated record header in %s" % path)
+            timestamp, event, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                raise CaptureError("Truncated record in %s" % path)
+            yield timestamp, event, marshal.loads(payload)
+    finally:
+        f.close()
+
+recorder = Recorder()
+
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+from heapq import heappush, heappop
+from itertools import count
+
+from zope.interface import implementer
+
+from twisted.internet.error import AlreadyCalled, AlreadyCancelled
+from twisted.internet.interfaces import IDelayedCall
+
+@implementer(IDelayedCall)
+class VirtualCall(object):
+    """
+    Call scheduled on VirtualClock. Rescheduling pushes the call to the
+    heap of its clock again, `seq` tells the current heap entry apart
+    from stale ones.
+    """
+    __slots__ = ('clock', 'time', 'func', 'args', 'kw', 'seq', 'called', 'cancelled')
+
+    def __init__(self, clock, time, func, args, kw):
+        self.clock = clock
+        self.time = time
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.seq = None
+        self.called = False
+        self.cancelled = False
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        self._checkActive()
+        self.cancelled = True
+
+    def reset(self, secondsFromNow):
+        self._checkActive()
+        self.time = self.clock.seconds() + secondsFromNow
+        self.clock._push(self)
+
+    def delay(self, secondsLater):
+        self._checkActive()
+        self.time += secondsLater
+        self.clock._push(self)
+
+    def _checkActive(self):
+        if self.cancelled:
+            raise AlreadyCancelled
+        if self.called:
+            raise AlreadyCalled
+
+class VirtualClock(object):
+    """
+    Virtual time provider for PresenceService and SIPPresence, like
+    twisted.internet.task.Clock but scheduling is O(log n): pending calls
+    are kept in heap, cancelled and rescheduled calls are dropped lazily.
+    Suitable for simulations with millions of timers.
+    """
+    def __init__(self, now=0.0):
+        self.now = now
+        self._calls = []
+        self._seq = count()
+
+    def seconds(self):
+        return self.now
+
+    def callLater(self, delay, f, *args, **kw):
+        call = VirtualCall(self, self.now + delay, f, args, kw)
+        self._push(call)
+        return call
+
+    def getDelayedCalls(self):
+        return [call for _, seq, call in self._calls if call.active() and call.seq == seq]
+
+    def nextCallTime(self):
+        while self._calls:
+            t, seq, call = self._calls[0]
+            if call.active() and call.seq == seq:
+                return t
+            heappop(self._calls)
+        return None
+
+    def advance(self, amount):
+        self.now += amount
+        while True:
+            t = self.nextCallTime()
+            if t is None or t > self.now:
+                break
+            _, _, call = heappop(self._calls)
+            call.called = True
+            call.func(*call.args, **call.kw)
+
+    def run(self, until=None):
+        """
+        Advance time to every pending call (including calls scheduled
+        meanwhile) until there is nothing to do or `until` is reached.
+        """
+        while True:
+            t = self.nextCallTime()
+            if t is None or (until is not None and t > until):
+                break
+            self.advance(max(0, t - self.now))
+        if until is not None and until > self.now:
+            self.now = until
+
+    def _push(self, call):
+        call.seq = next(self._seq)
+        heappush(self._calls, (call.time, call.seq, call))
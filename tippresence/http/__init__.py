@@ -2,4 +2,7 @@ from twisted.web import resource, server
 
 from stats import HTTPStats
 from presence import HTTPPresence
+from lists import HTTPResourceLists
+from domains import HTTPDomains
+from admin import HTTPAdmin, TimedSite
 
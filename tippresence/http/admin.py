@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+from tippresence import stats
+from tippresence.capture import recorder, CaptureError
+from tippresence.introspection import SamplingProfiler, ProfilerError, requests_log
+from tippresence.introspection import memory_usage
+
+class TimedSite(server.Site):
+    """
+    Site that records duration of every request to requests_log.
+    """
+    def getResourceFor(self, request):
+        if requests_log.enabled:
+            name = '%s %s' % (request.method, request.uri)
+            started_at = reactor.seconds()
+            d = request.notifyFinish()
+            d.addBoth(lambda _: requests_log.record('http', name, started_at))
+        return server.Site.getResourceFor(self, request)
+
+
+class HTTPAdmin(resource.Resource):
+    """
+    Runtime introspection: sampling profiler, memory usage of presence
+    structures, slowest recent requests and traffic capture. Disabled until enable() is
+    called (e.g. from signal handler), so it doesn't need restart. There is
+    no authentication, serve it on loopback interface only.
+    """
+    isLeaf = True
+    MAX_PROFILE_SECONDS = 300
+
+    def __init__(self, presence, sip=None, capture_path=None):
+        self.presence = presence
+        self.sip = sip
+        self.capture_path = capture_path
+        self.enabled = False
+        self.profiler = SamplingProfiler()
+
+    def enable(self):
+        self.enabled = True
+        requests_log.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        requests_log.enabled = False
+        self.profiler.stop()
+        recorder.stop()
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def _filterPath(self, path):
+        return [x for x in path if x]
+
+    def render(self, request):
+        stats['http_received_requests'] += 1
+        if not self.enabled:
+            request.setResponseCode(403)
+            return json.dumps({'status': 'failure', 'reason': 'Admin interface disabled'})
+        return resource.Resource.render(self, request)
+
+    def render_GET(self, request):
+        path = self._filterPath(request.postpath)
+        if path == ['profile']:
+            return self._reply(self.profiler.result())
+        if path == ['memory']:
+            return self._reply(self.memory())
+        if path == ['requests']:
+            return self._reply(requests_log.slowest())
+        if path == ['capture']:
+            return self._reply({'recording': recorder.recording(), 'path': recorder.path, 'records': recorder.records})
+        return json.dumps({'reason': 'Invalid URI', 'status': 'failure'})
+
+    def render_POST(self, request):
+        path = self._filterPath(request.postpath)
+        if path == ['capture']:
+            return self.startCapture()
+        if path != ['profile']:
+            return json.dumps({'reason': 'Invalid URI', 'status': 'failure'})
+        try:
+            seconds = float(request.args.get('seconds', [10])[0])
+        except ValueError, e:
+            return json.dumps({'reason': str(e), 'status': 'failure'})
+        if not 0 < seconds <= self.MAX_PROFILE_SECONDS:
+            return json.dumps({'reason': 'Invalid profiling duration', 'status': 'failure'})
+        try:
+            self.profiler.start(seconds)
+        except ProfilerError, e:
+            return json.dumps({'reason': str(e), 'status': 'failure'})
+        return json.dumps({'reason': 'Profiler started', 'status': 'ok'})
+
+    def render_DELETE(self, request):
+        path = self._filterPath(request.postpath)
+        if path == ['capture']:
+            recorder.stop()
+            return json.dumps({'reason': 'Capture stopped', 'status': 'ok'})
+        if path != ['profile']:
+            return json.dumps({'reason': 'Invalid URI', 'status': 'failure'})
+        self.profiler.stop()
+        return json.dumps({'reason': 'Profiler stopped', 'status': 'ok'})
+
+    def startCapture(self):
+        if not self.capture_path:
+            return json.dumps({'reason': 'Capture file is not configured', 'status': 'failure'})
+        try:
+            recorder.start(self.capture_path)
+        except (CaptureError, IOError), e:
+            return json.dumps({'reason': str(e), 'status': 'failure'})
+        return json.dumps({'reason': 'Capture started', 'status': 'ok'})
+
+    def memory(self):
+        r = self.presence.memoryUsage()
+        r['storage'] = memory_usage(self.presence.storage)
+        if self.sip:
+            r.update(self.sip.memoryUsage())
+            r['dialogs'] = memory_usage(self.sip.dialog_store)
+        return r
+
+    def _reply(self, result):
+        return json.dumps({'status': 'ok', 'reason': 'success', 'result': result})
+
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from twisted.web import resource
+
+from tippresence import stats
+
+class HTTPDomains(resource.Resource):
+    isLeaf = True
+    DEFAULT_LIMIT = 100
+    MAX_LIMIT = 1000
+
+    def __init__(self, presence):
+        self.presence = presence
+
+    def _filterPath(self, path):
+        return [x for x in path if x]
+
+    def _arg(self, request, name, default):
+        return request.args.get(name, [default])[0]
+
+    def render_GET(self, request):
+        stats['http_received_requests'] += 1
+        path = self._filterPath(request.postpath)
+        status = self._arg(request, 'status', 'online')
+        if len(path) == 0:
+            return self.countByDomain(status)
+        if len(path) == 1:
+            return self.count(path[0], status)
+        if len(path) == 2 and path[1] == 'resources':
+            try:
+                offset = int(self._arg(request, 'offset', 0))
+                limit = int(self._arg(request, 'limit', self.DEFAULT_LIMIT))
+            except ValueError, e:
+                return json.dumps({'reason': str(e), 'status': 'failure'})
+            if offset < 0 or not 0 < limit <= self.MAX_LIMIT:
+                return json.dumps({'reason': 'Invalid offset or limit', 'status': 'failure'})
+            return self.getResources(path[0], status, offset, limit)
+        return json.dumps({'reason': 'Invalid URI', 'status': 'failure'})
+
+    def countByDomain(self, status):
+        result = self.presence.countResourcesByDomain(status)
+        return json.dumps({'status': 'ok', 'reason': 'success', 'result': result})
+
+    def count(self, domain, status):
+        result = {'count': self.presence.countResources(domain, status)}
+        return json.dumps({'status': 'ok', 'reason': 'success', 'result': result})
+
+    def getResources(self, domain, status, offset, limit):
+        resources = self.presence.getResources(domain, status, offset, limit)
+        result = {
+                'count': self.presence.countResources(domain, status),
+                'offset': offset,
+                'resources': resources,
+                }
+        return json.dumps({'status': 'ok', 'reason': 'success', 'result': result})
+
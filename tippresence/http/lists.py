@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from twisted.web import resource, server
+
+from tippresence import stats
+from tippresence import capture
+from tippresence.capture import recorder
+
+class HTTPResourceLists(resource.Resource):
+    isLeaf = True
+    def __init__(self, presence):
+        self.presence = presence
+
+    def _filterPath(self, path):
+        return [x for x in path if x]
+
+    def render_GET(self, request):
+        stats['http_received_requests'] += 1
+        path = self._filterPath(request.postpath)
+        if len(path) == 1:
+            return self.getResourceList(request.write, request.finish, path[0])
+        return json.dumps({'reason': 'Invalid URI', 'status': 'failure'})
+
+    def render_PUT(self, request):
+        stats['http_received_requests'] += 1
+        path = self._filterPath(request.postpath)
+        if len(path) == 1:
+            return self.putResourceList(request.write, request.finish, path[0], request.content)
+        return json.dumps({'reason': 'Invalid URI', 'status': 'failure'})
+
+    def render_DELETE(self, request):
+        stats['http_received_requests'] += 1
+        path = self._filterPath(request.postpath)
+        if len(path) == 1:
+            return self.removeResourceList(request.write, request.finish, path[0])
+        return json.dumps({'reason': 'Invalid URI', 'status': 'failure'})
+
+    def getResourceList(self, write, finish, uri):
+        def reply(resources):
+            write(json.dumps({'status': 'ok', 'reason': 'success', 'result': resources}))
+            finish()
+
+        d = self.presence.getResourceList(uri)
+        d.addCallback(reply)
+        return server.NOT_DONE_YET
+
+    def putResourceList(self, write, finish, uri, content):
+        def reply(r):
+            write(json.dumps({'reason': 'Resource list updated', 'status': 'ok'}))
+            finish()
+
+        try:
+            resources = json.load(content)
+        except ValueError, e:
+            return json.dumps({'reason': str(e), 'status': 'failure'})
+        if not isinstance(resources, list):
+            return json.dumps({'reason': 'List of resources required', 'status': 'failure'})
+        recorder.record(capture.HTTP_PUT_LIST, self.presence.clock.seconds(), uri, resources)
+        d = self.presence.putResourceList(uri, resources)
+        d.addCallback(reply)
+        return server.NOT_DONE_YET
+
+    def removeResourceList(self, write, finish, uri):
+        def reply(r):
+            write(json.dumps({'reason': r, 'status': 'ok'}))
+            finish()
+
+        recorder.record(capture.HTTP_REMOVE_LIST, self.presence.clock.seconds(), uri)
+        d = self.presence.removeResourceList(uri)
+        d.addCallback(reply)
+        return server.NOT_DONE_YET
+
@@ -8,8 +8,10 @@ from twisted.web import resource, server
 from tippresence import stats
 from tippresence import aggregate_status
 from tippresence import PresenceServiceError
+from tippresence import capture
+from tippresence.capture import recorder
 
-from twisted.python import log
+from twisted.python import failure, log
 
 success_reply = {'status': 'ok', 'reason': 'Success'}
 
@@ -60,6 +62,7 @@ class HTTPPresence(resource.Resource):
             write(json.dumps(res))
             finish()
 
+        recorder.record(capture.HTTP_GET, self.presence.clock.seconds(), resource)
         d = self.presence.getStatus(resource)
         d.addCallback(aggregate_status)
         d.addCallback(reply)
@@ -74,11 +77,17 @@ class HTTPPresence(resource.Resource):
             write(json.dumps({'status': 'ok', 'reason': 'Successfully dumped', 'result': result}))
             finish()
 
+        recorder.record(capture.HTTP_DUMP, self.presence.clock.seconds())
         d = self.presence.dumpStatuses()
         d.addCallback(reply)
         return server.NOT_DONE_YET
 
     def putStatus(self, write, finish, resource, content, tag=None):
+        def record(r):
+            tag = kw.get('tag', '') if isinstance(r, failure.Failure) else r
+            recorder.record(capture.HTTP_PUT, started_at, resource, tag, args[1], args[2], kw.get('priority', 0))
+            return r
+
         def reply(tag):
             result = {'tag': tag}
             r = json.dumps({'reason': 'Status added', 'status': 'ok', 'result': result})
@@ -107,7 +116,9 @@ class HTTPPresence(resource.Resource):
             kw['priority'] = int(r['priority'])
         if tag:
             kw['tag'] = tag
+        started_at = self.presence.clock.seconds()
         d = self.presence.putStatus(*args, **kw)
+        d.addBoth(record)
         d.addCallback(reply)
         d.addErrback(reply_error)
         return server.NOT_DONE_YET
@@ -118,6 +129,7 @@ class HTTPPresence(resource.Resource):
             write(r)
             finish()
 
+        recorder.record(capture.HTTP_REMOVE, self.presence.clock.seconds(), resource, tag)
         d = self.presence.removeStatus(resource, tag)
         d.addCallback(reply)
         return server.NOT_DONE_YET
@@ -129,6 +141,11 @@ class HTTPPresence(resource.Resource):
         def reply_error(r):
             write(json.dumps({'reason': 'Failed: %s' % str(r), 'status': 'failure'}))
             finish()
+        def record(r, started_at, args, kw):
+            resource, pdoc, expires = args
+            tag = kw.get('tag', '') if isinstance(r, failure.Failure) else r
+            recorder.record(capture.HTTP_PUT, started_at, resource, tag, pdoc, expires, kw.get('priority', 0))
+            return r
 
         try:
             docs = json.load(content)
@@ -145,7 +162,9 @@ class HTTPPresence(resource.Resource):
                 kw['priority'] = int(r['priority'])
             if 'tag' in r:
                 kw['tag'] = r['tag']
-            d.append(self.presence.putStatus(*args, **kw))
+            put = self.presence.putStatus(*args, **kw)
+            put.addBoth(record, self.presence.clock.seconds(), args, kw)
+            d.append(put)
         defer.DeferredList(d, fireOnOneErrback=True).addCallbacks(reply, reply_error)
         return server.NOT_DONE_YET
 
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_left, insort
+
+from tippresence.introspection import describe
+
+def resource_domain(resource):
+    return resource.rpartition('@')[2]
+
+class SortedMembers(object):
+    """
+    Sorted set of resources split into blocks of at most 2 * BLOCK items.
+    Update bisects block maxima and touches single block, so its cost
+    does not grow with the number of members the way list insertion does.
+    """
+    BLOCK = 512
+
+    def __init__(self):
+        self._blocks = []
+        self._maxes = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def add(self, item):
+        self._len += 1
+        if not self._blocks:
+            self._blocks.append([item])
+            self._maxes.append(item)
+            return
+        i = bisect_left(self._maxes, item)
+        if i == len(self._maxes):
+            i -= 1
+            self._blocks[i].append(item)
+            self._maxes[i] = item
+        else:
+            insort(self._blocks[i], item)
+        block = self._blocks[i]
+        if len(block) > 2 * self.BLOCK:
+            self._blocks[i:i + 1] = [block[:self.BLOCK], block[self.BLOCK:]]
+            self._maxes[i:i + 1] = [block[self.BLOCK - 1], block[-1]]
+
+    def remove(self, item):
+        i = bisect_left(self._maxes, item)
+        block = self._blocks[i]
+        del block[bisect_left(block, item)]
+        self._len -= 1
+        if not block:
+            del self._blocks[i]
+            del self._maxes[i]
+        else:
+            self._maxes[i] = block[-1]
+
+    def slice(self, offset=0, limit=None):
+        r = []
+        for block in self._blocks:
+            if offset >= len(block):
+                offset -= len(block)
+                continue
+            r.extend(block[offset:])
+            offset = 0
+            if limit is not None and len(r) >= limit:
+                break
+        return r[:limit]
+
+class StatusIndex(object):
+    """
+    Resources indexed by aggregated status and domain. Members of every
+    (status, domain) pair are kept in SortedMembers, so counts are O(1),
+    updates stay cheap in large domains and pages are sliced without
+    walking the whole index.
+    """
+    def __init__(self):
+        self._members = {}
+        self._status = {}
+
+    def update(self, resource, status):
+        old = self._status.get(resource)
+        if old == status:
+            return
+        if old is not None:
+            self._remove(resource, old)
+        if status is not None:
+            self._status[resource] = status
+            key = (status, resource_domain(resource))
+            members = self._members.get(key)
+            if members is None:
+                members = self._members[key] = SortedMembers()
+            members.add(resource)
+
+    def remove(self, resource):
+        self.update(resource, None)
+
+    def memoryUsage(self):
+        return describe(self._status)
+
+    def count(self, domain, status):
+        return len(self._members.get((status, domain), ()))
+
+    def countByDomain(self, status):
+        return dict((d, len(m)) for (s, d), m in self._members.iteritems() if s == status)
+
+    def members(self, domain, status, offset=0, limit=None):
+        members = self._members.get((status, domain))
+        if members is None:
+            return []
+        return members.slice(offset, limit)
+
+    def _remove(self, resource, status):
+        del self._status[resource]
+        key = (status, resource_domain(resource))
+        members = self._members[key]
+        members.remove(resource)
+        if not members:
+            del self._members[key]
+
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import thread
+import threading
+import time
+from collections import defaultdict, deque
+from itertools import chain, islice
+
+from twisted.internet import reactor
+
+def approx_size(obj, depth=2):
+    """
+    Approximate memory used by obj in bytes: size of container plus
+    sizes of its items down to given depth.
+    """
+    size = sys.getsizeof(obj)
+    if not depth:
+        return size
+    if isinstance(obj, dict):
+        items = chain(obj.iterkeys(), obj.itervalues())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        items = obj
+    else:
+        return size
+    return size + sum(approx_size(x, depth - 1) for x in items)
+
+def describe(obj, sample=100):
+    """
+    Entries and approximate size of container. Size of items is
+    estimated from the first `sample` of them, so the cost doesn't grow
+    with the container.
+    """
+    n = len(obj)
+    size = sys.getsizeof(obj)
+    if n:
+        if isinstance(obj, dict):
+            items = [approx_size(k, 1) + approx_size(v, 1) for k, v in islice(obj.iteritems(), sample)]
+        else:
+            items = [approx_size(x, 1) for x in islice(obj, sample)]
+        size += sum(items) * n / len(items)
+    return {'entries': n, 'approx_bytes': size}
+
+def memory_usage(obj):
+    """
+    Memory usage reported by object we don't own (storage, dialog store)
+    through its memoryUsage() accessor, None if it has no such accessor.
+    """
+    usage = getattr(obj, 'memoryUsage', None)
+    if usage is None:
+        return None
+    return usage()
+
+
+class ProfilerError(Exception):
+    pass
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler: separate thread takes stack of reactor thread
+    every `interval` seconds and counts identical stacks.
+    """
+    MAX_STACKS = 100
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = {}
+        self.started_at = None
+        self.finished_at = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def running(self):
+        return bool(self._thread and self._thread.isAlive())
+
+    def start(self, duration):
+        if self.running():
+            raise ProfilerError("Profiler is already running")
+        self.samples = defaultdict(int)
+        self.started_at = time.time()
+        self.finished_at = None
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, args=(thread.get_ident(), duration))
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def result(self):
+        samples = dict(self.samples)
+        total = sum(samples.itervalues())
+        stacks = sorted(samples.iteritems(), key=lambda x: x[1], reverse=True)[:self.MAX_STACKS]
+        return {
+                'running': self.running(),
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'samples': total,
+                'stacks': [{'count': c, 'stack': ';'.join(s)} for s, c in stacks],
+                }
+
+    def _run(self, thread_id, duration):
+        deadline = time.time() + duration
+        while not self._stopped.isSet() and time.time() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%d(%s)' % (code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            del frame
+            stack.reverse()
+            self.samples[tuple(stack)] += 1
+            self._stopped.wait(self.interval)
+        self.finished_at = time.time()
+
+
+class RequestLog(object):
+    """
+    Durations of last `size` requests, recorded only while enabled.
+    """
+    def __init__(self, size=1000):
+        self.enabled = False
+        self._requests = deque(maxlen=size)
+
+    def record(self, kind, name, started_at):
+        if self.enabled:
+            finished_at = reactor.seconds()
+            self._requests.append((finished_at - started_at, kind, name, finished_at))
+
+    def timed(self, kind, name_func):
+        """
+        Decorator of request handlers returning deferred.
+        """
+        def decorator(f):
+            def wrapper(*args, **kwargs):
+                started_at = reactor.seconds()
+                d = f(*args, **kwargs)
+                d.addBoth(self._done, kind, name_func(*args, **kwargs), started_at)
+                return d
+            wrapper.__name__ = f.__name__
+            wrapper.__doc__ = f.__doc__
+            return wrapper
+        return decorator
+
+    def slowest(self, count=20):
+        r = sorted(self._requests, reverse=True)[:count]
+        return [{'duration': d, 'kind': k, 'name': n, 'finished_at': t} for d, k, n, t in r]
+
+    def _done(self, r, kind, name, started_at):
+        self.record(kind, name, started_at)
+        return r
+
+requests_log = RequestLog()
+
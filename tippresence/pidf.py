@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+from xml.parsers import expat
+
+NS_PIDF = 'urn:ietf:params:xml:ns:pidf'
+NS_DM = 'urn:ietf:params:xml:ns:pidf:data-model'
+NS_RPID = 'urn:ietf:params:xml:ns:pidf:rpid'
+
+TUPLE = NS_PIDF + ' tuple'
+BASIC = NS_PIDF + ' basic'
+NOTES = (NS_PIDF + ' note', NS_DM + ' note')
+ACTIVITIES = NS_RPID + ' activities'
+
+MAX_PIDF_SIZE = 65536
+
+class PIDFError(Exception):
+    pass
+
+class _PIDFHandler(object):
+    def __init__(self):
+        self.tuples = []
+        self.notes = []
+        self.activities = []
+        self._tuple_id = None
+        self._activities_depth = 0
+        self._depth = 0
+        self._text = None
+
+    def start(self, name, attrs):
+        self._depth += 1
+        if name == TUPLE:
+            self._tuple_id = attrs.get('id')
+        elif name == BASIC or name in NOTES:
+            self._text = []
+        elif name == ACTIVITIES:
+            self._activities_depth = self._depth
+        elif self._activities_depth == self._depth - 1 and self._activities_depth:
+            localname = name.rpartition(' ')[2]
+            if localname != 'note':
+                self.activities.append(localname)
+
+    def end(self, name):
+        self._depth -= 1
+        if self._text is None:
+            if name == ACTIVITIES:
+                self._activities_depth = 0
+            return
+        text = ''.join(self._text).strip()
+        self._text = None
+        if name == BASIC:
+            self.tuples.append((self._tuple_id, text))
+        elif text:
+            self.notes.append(text)
+
+    def data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def doctype(self, *args):
+        raise PIDFError("DOCTYPE is not allowed in PIDF document")
+
+def parse_pidf(pidf):
+    """
+    Parse PIDF (RFC 3863) document with RPID extensions in one pass.
+    Returns presence document: status is online if any tuple is open,
+    note and activities are added only when present.
+    """
+    if len(pidf) > MAX_PIDF_SIZE:
+        raise PIDFError("PIDF document too large: %d bytes" % len(pidf))
+    handler = _PIDFHandler()
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.buffer_text = True
+    parser.returns_unicode = False
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+    parser.StartDoctypeDeclHandler = handler.doctype
+    try:
+        parser.Parse(pidf, True)
+    except expat.ExpatError, e:
+        raise PIDFError("Malformed PIDF document: %s" % e)
+    if [t for t in handler.tuples if t[1] == 'open']:
+        presence = {'status': 'online'}
+    else:
+        presence = {'status': 'offline'}
+    if handler.notes:
+        presence['note'] = handler.notes[0]
+    if handler.activities:
+        presence['activities'] = handler.activities
+    return presence
+
+class PIDFCache(object):
+    """
+    LRU cache of parsed PIDF documents keyed by document body, so identical
+    bodies are parsed once whatever resource or entity tag they are
+    published with. Size is limited by total bytes of cached bodies.
+
+    Lookup key is built from body length, head and tail instead of hashing
+    whole body; hit is confirmed by comparing bodies. Recently used entry
+    is stamped with use counter, when cache is over `max_bytes` least
+    recently used entries are evicted down to 3/4 of it at once.
+    Returns copy of cached presence document.
+    """
+    KEY_BYTES = 64
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+        self._used = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def memoryUsage(self):
+        return {
+                'entries': len(self._cache),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                }
+
+    def parse(self, pidf):
+        n = self.KEY_BYTES
+        key = (len(pidf), pidf[:n], pidf[-n:])
+        self._used += 1
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == pidf:
+            self.hits += 1
+            entry[2] = self._used
+            return dict(entry[1])
+        self.misses += 1
+        presence = parse_pidf(pidf)
+        if entry is not None:
+            self.bytes -= len(entry[0])
+        self._cache[key] = [pidf, presence, self._used]
+        self.bytes += len(pidf)
+        if self.bytes > self.max_bytes:
+            self._evict(self.max_bytes * 3 / 4)
+        return dict(presence)
+
+    def _evict(self, max_bytes):
+        entries = sorted(self._cache.iteritems(), key=lambda (key, entry): entry[2])
+        for key, entry in entries:
+            if self.bytes <= max_bytes:
+                break
+            del self._cache[key]
+            self.bytes -= len(entry[0])
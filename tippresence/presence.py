@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import json
+from heapq import heappush, heappop
 
 import utils
 
@@ -8,10 +9,13 @@ from twisted.internet import reactor, defer
 from twisted.python import log
 
 from tippresence import stats
+from tippresence.subscriber import Subscriber
+from tippresence.index import StatusIndex
+from tippresence.introspection import describe
 
-def debug(msg):
+def debug(msg, *args):
     if __debug__:
-        log.msg(msg)
+        log.msg(msg % args if args else msg)
 
 def aggregate_status(statuses):
     max_priority = None
@@ -46,11 +50,18 @@ class PresenceServiceError(Exception):
 class PresenceService(object):
     MAX_EXPIRE_TIME = 3900
 
-    def __init__(self, storage):
+    def __init__(self, storage, clock=reactor):
         storage.addCallbackOnConnected(self._loadStatusTimers)
+        storage.addCallbackOnConnected(self._loadStatusIndex)
         self.storage = storage
-        self._callbacks = []
+        self.clock = clock
+        self._subscribers = []
+        self._replicators = []
+        self._list_observers = []
+        self._tombstones = {}
+        self._tombstones_expiry = []
         self._status_timers = {}
+        self._index = StatusIndex()
 
     @defer.inlineCallbacks
     def putStatus(self, resource, pdoc, expires, priority=0, tag=None):
@@ -58,18 +69,14 @@ class PresenceService(object):
             raise PresenceServiceError("Expire limit exeeded")
         if not tag:
             tag = utils.random_str(10)
-        expiresat = expires + reactor.seconds()
-        table = self._resourceTable(resource)
-        rset = self._resourcesSet()
+        expiresat = expires + self.clock.seconds()
         status = Status(pdoc, expiresat, priority)
-        d1 = self.storage.hset(table, tag, status.serialize())
-        d2 = self.storage.sadd(rset, resource)
-        d3 = self._notifyWatchers(resource)
-        d4 = self._setStatusTimer(resource, tag, expires)
-        yield defer.DeferredList([d1, d2, d3, d4])
+        self._tombstones.pop((resource, tag), None)
+        yield self._storeStatus(resource, tag, status, expires)
+        self._replicate('statusPut', resource, tag, status)
         stats['presence_put_statuses'] += 1
-        log.msg("Put status (resource: %r, tag: %r, presence document: %r, expires: %r, priority: %r) ==> result: ok" %\
-                (resource, tag, pdoc, expires, priority))
+        debug("Put status (resource: %r, tag: %r, presence document: %r, expires: %r, priority: %r) ==> result: ok",
+                resource, tag, pdoc, expires, priority)
         defer.returnValue(tag)
 
     @defer.inlineCallbacks
@@ -79,15 +86,16 @@ class PresenceService(object):
             _, status = r[0]
         else:
             defer.returnValue('not_found')
-        expiresat = expires + reactor.seconds()
+        expiresat = expires + self.clock.seconds()
         status['expiresat'] = expiresat
         table = self._resourceTable(resource)
         d1 = self.storage.hset(table, tag, status.serialize())
         d2 = self._notifyWatchers(resource, status=r)
         d3 = self._setStatusTimer(resource, tag, expires)
         yield defer.DeferredList([d1, d2, d3])
+        self._replicate('statusPut', resource, tag, status)
         stats['presence_updated_statuses'] += 1
-        log.msg("Update status (resource: %r, tag: %r, expires: %r) ==> result: ok" % (resource, tag, expires))
+        debug("Update status (resource: %r, tag: %r, expires: %r) ==> result: ok", resource, tag, expires)
 
     @defer.inlineCallbacks
     def getStatus(self, resource, tag=None):
@@ -100,21 +108,24 @@ class PresenceService(object):
             else:
                 r = yield self.storage.hgetall(table)
         except KeyError:
-            log.msg("Get status (resource: %r, tag: %r) ==> result: not found" % (resource, tag))
+            debug("Get status (resource: %r, tag: %r) ==> result: not found", resource, tag)
             defer.returnValue([])
         statuses = [(t, Status.parse(x)) for (t,  x) in r.iteritems()]
         active, expired = self._splitExpiredStatuses(statuses)
         if expired:
-            debug("Get status (resource: %r, tag: %r) ==> expired statuses found: %r" % (resource, tag, expired))
+            debug("Get status (resource: %r, tag: %r) ==> expired statuses found: %r", resource, tag, expired)
             for t, _ in expired:
-                self.removeStatus(resource, t)
-        log.msg("Get status (resource: %r, tag: %r) ==> result: %r" % (resource, tag, active))
+                self.removeStatus(resource, t, replicate=False)
+        debug("Get status (resource: %r, tag: %r) ==> result: %r", resource, tag, active)
         defer.returnValue(active)
 
     @defer.inlineCallbacks
     def dumpStatuses(self):
         rset = self._resourcesSet()
-        all_resources = yield self.storage.sgetall(rset)
+        try:
+            all_resources = yield self.storage.sgetall(rset)
+        except KeyError:
+            all_resources = []
         result = {}
         debug("Dump all statuses...")
         for resource in all_resources:
@@ -123,14 +134,17 @@ class PresenceService(object):
         defer.returnValue(result)
 
     @defer.inlineCallbacks
-    def removeStatus(self, resource, tag):
+    def removeStatus(self, resource, tag, replicate=True):
         stats['presence_removed_statuses'] += 1
         table = self._resourceTable(resource)
         yield self._cancelStatusTimer(resource, tag)
         try:
+            if replicate and self._replicators:
+                status = yield self.storage.hget(table, tag)
+                expiresat = Status.parse(status)['expiresat']
             yield self.storage.hdel(table, tag)
         except KeyError, e:
-            log.msg("Remove status (resource: %r, tag: %r) ==> result: not found" % (resource, tag))
+            debug("Remove status (resource: %r, tag: %r) ==> result: not found", resource, tag)
             defer.returnValue("not_found")
         try:
             yield self.storage.hgetall(table)
@@ -138,16 +152,180 @@ class PresenceService(object):
             rset = self._resourcesSet()
             yield self.storage.srem(rset, resource)
         yield self._notifyWatchers(resource)
-        log.msg("Remove status (resource: %r, tag: %r) ==> result: ok" % (resource, tag))
+        if replicate and self._replicators:
+            self._buryStatus(resource, tag, self.clock.seconds(), expiresat)
+            self._replicate('statusRemoved', resource, tag, expiresat)
+        debug("Remove status (resource: %r, tag: %r) ==> result: ok", resource, tag)
+        defer.returnValue("ok")
+
+    @defer.inlineCallbacks
+    def applyStatus(self, resource, tag, status, updated_at=None):
+        """
+        Apply status received from replication peer. Status with the same
+        tag and later expiration time wins, status updated before its
+        removal (see applyRemoval) is rejected. Known status is not
+        stored and watchers are not notified again.
+        """
+        expires = status['expiresat'] - self.clock.seconds()
+        if expires <= 0:
+            defer.returnValue('expired')
+        tombstone = self._getTombstone(resource, tag)
+        if tombstone:
+            removed_at, removed_expiresat = tombstone
+            if updated_at is None and status['expiresat'] <= removed_expiresat or \
+                    updated_at is not None and updated_at <= removed_at:
+                defer.returnValue('stale')
+            del self._tombstones[resource, tag]
+        r = yield self.getStatus(resource, tag)
+        if r and r[0][1]['expiresat'] > status['expiresat']:
+            defer.returnValue('stale')
+        if r and r[0][1] == status:
+            defer.returnValue('unchanged')
+        yield self._storeStatus(resource, tag, status, expires)
+        debug("Apply status (resource: %r, tag: %r, status: %r) ==> result: ok", resource, tag, status)
+        defer.returnValue('ok')
+
+    @defer.inlineCallbacks
+    def applyRemoval(self, resource, tag, expiresat, removed_at=None):
+        """
+        Apply status removal received from replication peer. Status that
+        was refreshed after removed one is kept. Removal is remembered
+        until removed status would expire, so put of the status delivered
+        after removal does not bring it back.
+        """
+        r = yield self.getStatus(resource, tag)
+        if r and r[0][1]['expiresat'] > expiresat:
+            defer.returnValue('stale')
+        if removed_at is None:
+            removed_at = self.clock.seconds()
+        self._buryStatus(resource, tag, removed_at, expiresat)
+        if not r:
+            defer.returnValue('not_found')
+        r = yield self.removeStatus(resource, tag, replicate=False)
+        defer.returnValue(r)
+
+    def addReplicator(self, replicator):
+        self._replicators.append(replicator)
+
+    def addListObserver(self, observer):
+        """
+        Observer's resourceListChanged(uri, added, removed) is called when
+        members of resource list change.
+        """
+        self._list_observers.append(observer)
+
+    def countResources(self, domain, status='online'):
+        return self._index.count(domain, status)
+
+    def countResourcesByDomain(self, status='online'):
+        return self._index.countByDomain(status)
+
+    def getResources(self, domain, status='online', offset=0, limit=None):
+        return self._index.members(domain, status, offset, limit)
+
+    @defer.inlineCallbacks
+    def putResourceList(self, uri, resources):
+        table = self._resourceListSet(uri)
+        old = yield self.getResourceList(uri)
+        removed = set(old) - set(resources)
+        added = set(resources) - set(old)
+        for resource in removed:
+            yield self.storage.srem(table, resource)
+        for resource in added:
+            yield self.storage.sadd(table, resource)
+        if added or removed:
+            yield defer.gatherResults([defer.maybeDeferred(o.resourceListChanged, uri, added, removed)
+                for o in self._list_observers], consumeErrors=True)
+        log.msg("Put resource list (uri: %r, resources: %r) ==> result: ok" % (uri, resources))
+
+    @defer.inlineCallbacks
+    def getResourceList(self, uri):
+        table = self._resourceListSet(uri)
+        try:
+            r = yield self.storage.sgetall(table)
+        except KeyError:
+            defer.returnValue([])
+        defer.returnValue(list(r))
+
+    @defer.inlineCallbacks
+    def removeResourceList(self, uri):
+        resources = yield self.getResourceList(uri)
+        if not resources:
+            log.msg("Remove resource list (uri: %r) ==> result: not found" % uri)
+            defer.returnValue("not_found")
+        yield self.putResourceList(uri, [])
+        log.msg("Remove resource list (uri: %r) ==> result: ok" % uri)
         defer.returnValue("ok")
 
     def watch(self, callback, *args, **kwargs):
-        self._callbacks.append((callback, args, kwargs))
+        return self.subscribe(callback, args=args, kwargs=kwargs)
+
+    def subscribe(self, callback, name=None, **kwargs):
+        """
+        Subscribe callback to status changes. Subscriber names must be
+        unique, name derived from callback gets a numeric suffix if taken.
+        """
+        names = set(s.name for s in self._subscribers)
+        if name is None:
+            base = name = getattr(callback, '__name__', 'subscriber')
+            n = 1
+            while name in names:
+                n += 1
+                name = '%s#%d' % (base, n)
+        elif name in names:
+            raise PresenceServiceError("Subscriber %r already exists" % name)
+        subscriber = Subscriber(name, callback, clock=self.clock, **kwargs)
+        self._subscribers.append(subscriber)
+        return subscriber
+
+    def dumpSubscribers(self):
+        return dict((s.name, s.dump()) for s in self._subscribers)
+
+    def memoryUsage(self):
+        """
+        Entries and approximate size of in-memory structures.
+        """
+        return {
+                'status_timers': describe(self._status_timers),
+                'status_index': self._index.memoryUsage(),
+                'tombstones': describe(self._tombstones),
+                'subscribers': dict((s.name, s.depth()) for s in self._subscribers),
+                }
+
+    def _storeStatus(self, resource, tag, status, expires):
+        table = self._resourceTable(resource)
+        rset = self._resourcesSet()
+        d1 = self.storage.hset(table, tag, status.serialize())
+        d2 = self.storage.sadd(rset, resource)
+        d3 = self._notifyWatchers(resource)
+        d4 = self._setStatusTimer(resource, tag, expires)
+        return defer.DeferredList([d1, d2, d3, d4])
+
+    def _replicate(self, method, *args):
+        for replicator in self._replicators:
+            getattr(replicator, method)(*args)
+
+    def _buryStatus(self, resource, tag, removed_at, expiresat):
+        self._pruneTombstones()
+        self._tombstones[resource, tag] = (removed_at, expiresat)
+        heappush(self._tombstones_expiry, (expiresat, (resource, tag)))
+
+    def _getTombstone(self, resource, tag):
+        self._pruneTombstones()
+        return self._tombstones.get((resource, tag))
+
+    def _pruneTombstones(self):
+        cur_time = self.clock.seconds()
+        heap = self._tombstones_expiry
+        while heap and heap[0][0] < cur_time:
+            expiresat, key = heappop(heap)
+            if key in self._tombstones and self._tombstones[key][1] == expiresat:
+                del self._tombstones[key]
 
     def _splitExpiredStatuses(self, statuses):
         active = []
         expired = []
-        cur_time = reactor.seconds()
+        cur_time = self.clock.seconds()
         for tag, status in statuses:
             if status['expiresat'] < cur_time:
                 expired.append((tag, status))
@@ -155,45 +333,41 @@ class PresenceService(object):
                 active.append((tag, status))
         return active, expired
 
-    @defer.inlineCallbacks
     def _setStatusTimer(self, resource, tag, delay, memonly=False):
         if (resource, tag) in self._status_timers:
             self._status_timers[resource, tag].reset(delay)
         else:
             stats['presence_active_timers'] += 1
-            self._status_timers[resource, tag] = reactor.callLater(delay, self.removeStatus, resource, tag)
-        if not memonly:
-            yield self._storeStatusTimer(resource, tag, delay)
-        debug("Set status timer (resource: %r, tag: %r, delay: %r) ==> result: ok" % (resource, tag, delay))
+            self._status_timers[resource, tag] = self.clock.callLater(delay, self.removeStatus, resource, tag,
+                    replicate=False)
+        debug("Set status timer (resource: %r, tag: %r, delay: %r) ==> result: ok", resource, tag, delay)
+        if memonly:
+            return defer.succeed(None)
+        return self._storeStatusTimer(resource, tag, delay)
 
-    @defer.inlineCallbacks
     def _cancelStatusTimer(self, resource, tag):
-        if (resource, tag) in self._status_timers:
-            stats['presence_active_timers'] -= 1
-            timer = self._status_timers.pop((resource, tag))
-            if timer.active():
-                timer.cancel()
-            yield self._dropStatusTimer(resource, tag)
-            debug("Cancel status timer (resource: %r, tag: %r) ==> result: ok" % (resource, tag))
-        else :
-            debug("Cancel status timer (resource: %r, tag: %r) ==> result: not found" % (resource, tag))
+        if (resource, tag) not in self._status_timers:
+            debug("Cancel status timer (resource: %r, tag: %r) ==> result: not found", resource, tag)
+            return defer.succeed(None)
+        stats['presence_active_timers'] -= 1
+        timer = self._status_timers.pop((resource, tag))
+        if timer.active():
+            timer.cancel()
+        debug("Cancel status timer (resource: %r, tag: %r) ==> result: ok", resource, tag)
+        return self._dropStatusTimer(resource, tag)
 
-    @defer.inlineCallbacks
     def _storeStatusTimer(self, resource, tag, delay):
         table = self._timersTable()
         key = '%s:%s' % (resource, tag)
-        expiresat = reactor.seconds() + delay
-        yield self.storage.hset(table, key, expiresat)
-        debug("Store status timer to storage (resource: %r, tag: %r, delay: %r) ==> result: ok" %\
-                (resource, tag, delay))
+        expiresat = self.clock.seconds() + delay
+        debug("Store status timer to storage (resource: %r, tag: %r, delay: %r)", resource, tag, delay)
+        return self.storage.hset(table, key, expiresat)
 
-    @defer.inlineCallbacks
     def _dropStatusTimer(self, resource, tag):
         table = self._timersTable()
         key = '%s:%s' % (resource, tag)
-        yield self.storage.hdel(table, key)
-        debug("Remove status timer from storage (resource: %r, tag: %r) ==> result: ok" %\
-                (resource, tag))
+        debug("Remove status timer from storage (resource: %r, tag: %r)", resource, tag)
+        return self.storage.hdel(table, key)
 
     @defer.inlineCallbacks
     def _loadStatusTimers(self):
@@ -203,19 +377,18 @@ class PresenceService(object):
             timers = yield self.storage.hgetall(table)
         except KeyError:
             defer.returnValue(None)
-        stale_timers = []
-        cur_time = reactor.seconds()
+        cur_time = self.clock.seconds()
         for key, expiresat in timers.iteritems():
             resource, tag = key.split(':')
             expiresat = float(expiresat)
             if expiresat < cur_time:
-                debug("Load status timers from storage (resource: %r, tag: %r, expires at: %r) ==> expired" %\
-                    (resource, tag, expiresat))
-                self.removeStatus(resource, tag)
+                debug("Load status timers from storage (resource: %r, tag: %r, expires at: %r) ==> expired",
+                        resource, tag, expiresat)
+                self.removeStatus(resource, tag, replicate=False)
             else:
                 delay = expiresat - cur_time
-                debug("Load status timers from storage (resource: %r, tag: %r, expires at: %r) ==> set timer" %\
-                    (resource, tag, expiresat))
+                debug("Load status timers from storage (resource: %r, tag: %r, expires at: %r) ==> set timer",
+                        resource, tag, expiresat)
                 yield self._setStatusTimer(resource, tag, delay, memonly=True)
         debug("Loading status timers ==> ok")
 
@@ -223,8 +396,29 @@ class PresenceService(object):
     def _notifyWatchers(self, resource, status=None):
         if not status:
             status = yield self.getStatus(resource)
-        for callback, arg, kw in self._callbacks:
-            callback(resource, status, *arg, **kw)
+            self._indexStatus(resource, status)
+        for subscriber in self._subscribers:
+            subscriber.put(resource, status)
+
+    def _indexStatus(self, resource, statuses):
+        presence = aggregate_status(statuses)['presence'] if statuses else None
+        if isinstance(presence, dict) and 'status' in presence:
+            self._index.update(resource, presence['status'])
+        else:
+            self._index.remove(resource)
+
+    @defer.inlineCallbacks
+    def _loadStatusIndex(self):
+        rset = self._resourcesSet()
+        try:
+            all_resources = yield self.storage.sgetall(rset)
+        except KeyError:
+            defer.returnValue(None)
+        debug("Start loading status index")
+        for resource in all_resources:
+            statuses = yield self.getStatus(resource)
+            self._indexStatus(resource, statuses)
+        debug("Loading status index ==> ok")
 
     def _resourceTable(self, resource):
         return 'res:' + resource
@@ -235,3 +429,6 @@ class PresenceService(object):
     def _resourcesSet(self):
         return 'sys:resources'
 
+    def _resourceListSet(self, uri):
+        return 'list:' + uri
+
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from twisted.internet import reactor, defer, protocol
+from twisted.protocols import basic
+from twisted.python import log
+
+from tippresence import stats
+from tippresence import utils
+from tippresence import Status
+
+class Replicator(object):
+    """
+    Replicates status changes of local PresenceService to peer nodes and
+    applies changes of peers to local storage, which is read replica of
+    the whole cluster. Conflicts are resolved by (resource, tag,
+    expiresat), so clocks of nodes are expected to be synchronized.
+
+    Statuses received from peers are not included in snapshot(), every
+    node pushes only statuses it owns.
+
+    Transport must provide start(replicator) and send(msg) methods and
+    pass received messages to messageReceived().
+    """
+    def __init__(self, presence_service, transport, node_id=None):
+        self.node_id = node_id or utils.random_str(10)
+        self.presence_service = presence_service
+        self.transport = transport
+        self._remote = set()
+        presence_service.addReplicator(self)
+        transport.start(self)
+
+    def statusPut(self, resource, tag, status):
+        self._remote.discard((resource, tag))
+        self._send(self._putMessage(resource, tag, status))
+
+    def statusRemoved(self, resource, tag, expiresat):
+        self._remote.discard((resource, tag))
+        msg = {'node': self.node_id, 'op': 'remove', 'resource': resource, 'tag': tag, 'expiresat': expiresat,
+                'ts': self.presence_service.clock.seconds()}
+        self._send(json.dumps(msg))
+
+    @defer.inlineCallbacks
+    def snapshot(self):
+        statuses = yield self.presence_service.dumpStatuses()
+        msgs = []
+        remote = set()
+        for resource, r in statuses.iteritems():
+            for tag, status in r:
+                if (resource, tag) in self._remote:
+                    remote.add((resource, tag))
+                else:
+                    msgs.append(self._putMessage(resource, tag, status))
+        self._remote = remote
+        defer.returnValue(msgs)
+
+    @defer.inlineCallbacks
+    def messageReceived(self, data):
+        try:
+            msg = json.loads(data)
+            if msg['node'] == self.node_id:
+                return
+            resource, tag = msg['resource'], msg['tag']
+            if msg['op'] == 'put':
+                s = msg['status']
+                status = Status(s['presence'], s['expiresat'], s['priority'])
+                r = yield self.presence_service.applyStatus(resource, tag, status, msg.get('ts'))
+                if r in ('ok', 'unchanged'):
+                    self._remote.add((resource, tag))
+            elif msg['op'] == 'remove':
+                r = yield self.presence_service.applyRemoval(resource, tag, msg['expiresat'], msg.get('ts'))
+                self._remote.discard((resource, tag))
+            else:
+                raise ValueError("Unknown operation: %r" % msg['op'])
+        except Exception:
+            stats['replication_errors'] += 1
+            log.err(None, "Failed to apply replicated message %r" % data)
+            return
+        if r in ('ok', 'expired'):
+            stats['replication_applied'] += 1
+        elif r == 'unchanged':
+            stats['replication_unchanged'] += 1
+        else:
+            stats['replication_rejected'] += 1
+
+    def _putMessage(self, resource, tag, status):
+        msg = {'node': self.node_id, 'op': 'put', 'resource': resource, 'tag': tag, 'status': status,
+                'ts': self.presence_service.clock.seconds()}
+        return json.dumps(msg)
+
+    def _send(self, msg):
+        stats['replication_sent'] += 1
+        d = defer.maybeDeferred(self.transport.send, msg)
+        d.addErrback(log.err, "Failed to send replication message")
+
+
+class LoopbackTransport(object):
+    """
+    Delivers messages to all nodes connected to the same hub in current
+    process. Useful for tests and simulations of the cluster.
+    """
+    def __init__(self, hub):
+        self.hub = hub
+
+    def start(self, replicator):
+        self.replicator = replicator
+        self.hub.append(self)
+
+    def send(self, msg):
+        return defer.DeferredList([t.replicator.messageReceived(msg) for t in self.hub if t is not self])
+
+
+class ReplicationProtocol(basic.NetstringReceiver):
+    MAX_LENGTH = 1048576
+
+    def connectionMade(self):
+        self.factory.connectionMade(self)
+
+    def connectionLost(self, reason):
+        self.factory.connectionLost(self)
+
+    def stringReceived(self, data):
+        self.factory.replicator.messageReceived(data)
+
+
+class ReplicationServerFactory(protocol.ServerFactory):
+    protocol = ReplicationProtocol
+
+    def __init__(self, replicator):
+        self.replicator = replicator
+
+    def connectionMade(self, proto):
+        log.msg("Replication peer connected: %r" % proto.transport.getPeer())
+
+    def connectionLost(self, proto):
+        log.msg("Replication peer disconnected: %r" % proto.transport.getPeer())
+
+
+class ReplicationClientFactory(protocol.ReconnectingClientFactory):
+    protocol = ReplicationProtocol
+    maxDelay = 30
+
+    def __init__(self, replicator):
+        self.replicator = replicator
+        self.connection = None
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        return protocol.ReconnectingClientFactory.buildProtocol(self, addr)
+
+    @defer.inlineCallbacks
+    def connectionMade(self, proto):
+        self.connection = proto
+        msgs = yield self.replicator.snapshot()
+        for msg in msgs:
+            proto.sendString(msg)
+        log.msg("Replication peer %r synchronized: %d statuses sent" % (proto.transport.getPeer(), len(msgs)))
+
+    def connectionLost(self, proto):
+        self.connection = None
+
+    def send(self, msg):
+        if self.connection:
+            self.connection.sendString(msg)
+
+
+class TCPTransport(object):
+    """
+    Full mesh of TCP links: every node listens for peers and connects to
+    each of them. Changes are sent over outgoing links only, local state
+    is pushed to the peer every time link is (re)established.
+
+    Links are not authenticated: any host reaching the port can put and
+    remove statuses. Transport listens on loopback by default, nodes on
+    different hosts must pass interface of trusted private network and
+    keep the port firewalled from everything but the peers.
+    """
+    def __init__(self, port, peers=(), interface='127.0.0.1'):
+        self.port = port
+        self.peers = peers
+        self.interface = interface
+        self.clients = []
+        self.replicator = None
+        self.listening_port = None
+
+    def start(self, replicator):
+        self.replicator = replicator
+        factory = ReplicationServerFactory(replicator)
+        self.listening_port = reactor.listenTCP(self.port, factory, interface=self.interface)
+        for host, port in self.peers:
+            self.addPeer(host, port)
+
+    def addPeer(self, host, port):
+        client = ReplicationClientFactory(self.replicator)
+        reactor.connectTCP(host, port, client)
+        self.clients.append(client)
+
+    def stop(self):
+        for client in self.clients:
+            client.stopTrying()
+            if client.connection:
+                client.connection.transport.loseConnection()
+        if self.listening_port:
+            return self.listening_port.stopListening()
+
+    def send(self, msg):
+        for client in self.clients:
+            client.send(msg)
+
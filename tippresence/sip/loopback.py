@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+SIPPresence without network: dialogs are kept in memory, requests and
+responses are collected instead of being sent. Used by tests and offline
+tools (replay, benchmarks) to drive PUBLISH and SUBSCRIBE processing.
+"""
+
+from itertools import count
+
+from twisted.internet import defer
+
+from tippresence.introspection import describe
+from tippresence.sip.presence import SIPPresence
+
+class Headers(dict):
+    def __init__(self, headers=None):
+        dict.__init__(self)
+        for name, value in (headers or {}).iteritems():
+            self[name] = value
+
+    def __setitem__(self, name, value):
+        dict.__setitem__(self, name.lower(), value)
+
+    def __getitem__(self, name):
+        return dict.__getitem__(self, name.lower())
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name.lower())
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+class URI(object):
+    def __init__(self, uri):
+        self.user, _, self.host = uri.rpartition('@')
+
+class Response(object):
+    def __init__(self, code, reason):
+        self.code = code
+        self.reason = reason
+        self.headers = Headers()
+
+class Request(object):
+    def __init__(self, method, uri=None, headers=None, content=None, dialog=None):
+        self.method = method
+        self.ruri = URI(uri) if uri else None
+        self.headers = Headers(headers)
+        self.content = content
+        self.dialog = dialog
+        self.has_totag = dialog is not None
+
+    def createResponse(self, code, reason):
+        return Response(code, reason)
+
+class Dialog(object):
+    def __init__(self, id):
+        self.id = id
+
+    def createRequest(self, method):
+        return Request(method, dialog=self)
+
+class DialogStore(object):
+    def __init__(self):
+        self.dialogs = {}
+
+    def get(self, id):
+        return defer.succeed(self.dialogs.get(id))
+
+    def memoryUsage(self):
+        return describe(self.dialogs)
+
+class TransactionLayer(object):
+    pass
+
+def subscribe_request(uri, expires, dialog=None, eventlist=True):
+    headers = {'Event': 'presence', 'Expires': str(expires)}
+    if eventlist:
+        headers['Supported'] = 'eventlist'
+    return Request('SUBSCRIBE', uri, headers, dialog=dialog)
+
+def publish_request(uri, pidf, expires, tag=None):
+    headers = {'Event': 'presence', 'Expires': str(expires)}
+    if pidf:
+        headers['Content-Type'] = 'application/pidf+xml'
+    if tag:
+        headers['SIP-If-Match'] = tag
+    return Request('PUBLISH', uri, headers, pidf)
+
+class LoopbackSIPPresence(SIPPresence):
+    """
+    SIPPresence sending nothing. Sent requests and responses are counted
+    and, with history=True, kept in `requests` and `responses`.
+    """
+    def __init__(self, storage, presence_service, clock=None, history=True):
+        self.history = history
+        self.requests = []
+        self.responses = []
+        self.sent_requests = 0
+        self.sent_responses = 0
+        self._dialog_ids = count(1)
+        SIPPresence.__init__(self, storage, DialogStore(), None, TransactionLayer(), presence_service, clock)
+
+    def createDialog(self, request):
+        dialog = Dialog(('call%d' % next(self._dialog_ids), 'from', 'to'))
+        self.dialog_store.dialogs[dialog.id] = dialog
+        request.dialog = dialog
+        return defer.succeed(dialog)
+
+    def removeDialog(self, id):
+        del self.dialog_store.dialogs[id]
+        return defer.succeed(None)
+
+    def sendRequest(self, request):
+        self.sent_requests += 1
+        if self.history:
+            self.requests.append(request)
+        return defer.succeed(None)
+
+    def sendResponse(self, response):
+        self.sent_responses += 1
+        if self.history:
+            self.responses.append(response)
@@ -1,11 +1,18 @@
 # -*- coding: utf-8 -*-
 
-import re
+import math
 from collections import defaultdict
 
-from twisted.internet import reactor, defer
+from twisted.internet import defer, task
+from twisted.python import log
 
 from tippresence import aggregate_status
+from tippresence import stats
+from tippresence import capture
+from tippresence.capture import recorder
+from tippresence.introspection import requests_log, describe
+from tippresence.pidf import PIDFCache, PIDFError, MAX_PIDF_SIZE
+from tippresence.sip.rlmi import multipart_related
 from tipsip import SIPUA, SIPError
 from tipsip.header import Header
 
@@ -31,26 +38,67 @@ def status2pidf(resource, statuses):
     a('</presence>')
     return '\n'.join(pidf)
 
+def pack_subscription(expiresat, resource, is_list=False):
+    """
+    Compact storage record of subscription: expiration time rounded up to
+    seconds, kind ('r' for resource, 'l' for resource list) and URI.
+    """
+    return '%d %s %s' % (math.ceil(expiresat), 'l' if is_list else 'r', resource)
+
+def unpack_subscription(record):
+    expiresat, kind, resource = record.split(' ', 2)
+    return float(expiresat), resource, kind == 'l'
+
 
 class SIPPresence(SIPUA):
     DEFAULT_PUBLISH_EXPIRES = 3600
     MIN_PUBLISH_EXPIRES = 60
     WATCHERS_SET_NAME = 'sys:watchers_by_resource:%s'
+    LIST_WATCHERS_SET_NAME = 'sys:list_watchers_by_resource:%s'
+    SUBSCRIPTIONS = 'sys:subscriptions'
+    LIST_VERSIONS = 'sys:list_versions'
+    # Layout of previous versions, converted to SUBSCRIPTIONS on load
     RESOURCE_BY_WATCHER = 'sys:resource_by_watcher'
     WATCHER_TIMERS = 'sys:watcher_timers'
+    LIST_BY_WATCHER = 'sys:list_by_watcher'
+    WATCHER_EXPIRY_BATCH = 500
+    LIST_NOTIFY_INTERVAL = 1
+    NOTIFY_CONCURRENCY = 10
+    PIDF_CACHE_BYTES = 8 * 1024 * 1024
 
-    online_re = re.compile('.*<status><basic>open</basic></status>.*')
-
-    def __init__(self, storage, dialog_store, transport, transaction_layer, presence_service):
+    def __init__(self, storage, dialog_store, transport, transaction_layer, presence_service, clock=None):
         SIPUA.__init__(self, dialog_store, transport, transaction_layer)
-        storage.addCallbackOnConnected(self._loadWatcherTimers)
+        storage.addCallbackOnConnected(self._loadSubscriptions)
         self.storage = storage
-        presence_service.watch(self.statusChangedCallback)
+        self.clock = clock or presence_service.clock
+        presence_service.subscribe(self.statusChangedCallback, name='sip', concurrency=self.NOTIFY_CONCURRENCY)
+        presence_service.addListObserver(self)
         self.presence_service = presence_service
-        self.watcher_expires_tid = {}
+        self.subscriptions = {}
+        self._watchers_by_list = {}
+        self._expiry_buckets = {}
+        self._expiry_tid = {}
+        self._pidf_cache = PIDFCache(self.PIDF_CACHE_BYTES)
+        self._list_versions = {}
+        self._list_changes = {}
+        self._list_full_state = set()
+        self._list_notify_tid = {}
 
+    def memoryUsage(self):
+        """
+        Entries and approximate size of in-memory structures.
+        """
+        return {
+                'subscriptions': describe(self.subscriptions),
+                'expiry_buckets': describe(self._expiry_buckets),
+                'list_watchers': describe(self._watchers_by_list),
+                'pidf_cache': self._pidf_cache.memoryUsage(),
+                }
+
+    @requests_log.timed('sip', lambda self, r: 'PUBLISH %s@%s' % (r.ruri.user, r.ruri.host))
     @defer.inlineCallbacks
     def handle_PUBLISH(self, publish):
+        started_at = self.clock.seconds()
         resource = publish.ruri.user + '@' + publish.ruri.host
         expires = publish.headers.get('expires', self.DEFAULT_PUBLISH_EXPIRES)
         expires = int(expires)
@@ -70,31 +118,54 @@ class SIPPresence(SIPUA):
         if expires and expires < self.MIN_PUBLISH_EXPIRES:
             raise SIPError(423, 'Interval Too Brief')
 
+        try:
+            etag = yield self.publish(resource, pidf, expires, tag)
+        except Exception:
+            # failed PUBLISHes (stale entity tags, bad bodies) are replayed too
+            recorder.record(capture.SIP_PUBLISH, started_at, resource, tag or '', '', expires, pidf or '')
+            raise
+        recorder.record(capture.SIP_PUBLISH, started_at, resource, tag or '', etag, expires, pidf or '')
+        response = publish.createResponse(200, 'OK')
+        response.headers['SIP-ETag'] = etag
+        response.headers['Expires'] = str(expires)
+        self.sendResponse(response)
+
+    @defer.inlineCallbacks
+    def publish(self, resource, pidf, expires, tag=None):
         if expires == 0:
             r = yield self.presence_service.removeStatus(resource, tag)
             if r == 'not_found':
                 raise SIPError(412, 'Conditional Request Failed')
+        elif tag and pidf:
+            r = yield self.presence_service.getStatus(resource, tag)
+            if not r:
+                raise SIPError(412, 'Conditional Request Failed')
+            tag = yield self.putStatus(resource, pidf, expires, tag)
         elif tag:
             r = yield self.presence_service.updateStatus(resource, tag, expires)
             if r == 'not_found':
                 raise SIPError(412, 'Conditional Request Failed')
         else:
             tag = yield self.putStatus(resource, pidf, expires, tag)
-        response = publish.createResponse(200, 'OK')
-        response.headers['SIP-ETag'] = tag
-        response.headers['Expires'] = str(expires)
-        self.sendResponse(response)
+        defer.returnValue(tag)
 
     @defer.inlineCallbacks
     def putStatus(self, resource, pidf, expires, tag):
-        pidf = ''.join(pidf.split())
-        if self.online_re.match(pidf):
-            presence = {'status': 'online'}
-        else:
-            presence = {'status': 'offline'}
+        presence = self.parsePIDF(pidf)
         tag = yield self.presence_service.putStatus(resource, presence, expires, tag=tag)
         defer.returnValue(tag)
 
+    def parsePIDF(self, pidf):
+        if not pidf:
+            return {'status': 'offline'}
+        if len(pidf) > MAX_PIDF_SIZE:
+            raise SIPError(413, 'Request Entity Too Large')
+        try:
+            return self._pidf_cache.parse(pidf)
+        except PIDFError:
+            raise SIPError(400, 'Bad Request')
+
+    @requests_log.timed('sip', lambda self, r: 'SUBSCRIBE %s@%s' % (r.ruri.user, r.ruri.host))
     @defer.inlineCallbacks
     def handle_SUBSCRIBE(self, subscribe):
         if subscribe.headers.get('Event') != 'presence':
@@ -109,13 +180,40 @@ class SIPPresence(SIPUA):
     @defer.inlineCallbacks
     def statusChangedCallback(self, resource, status):
         watchers = yield self._getResourceWatchers(resource)
-        if not watchers:
-            return
-        for watcher in watchers:
-            self.notifyWatcher(watcher)
+        notifies = [self.notifyWatcher(watcher) for watcher in watchers or []]
+        list_watchers = yield self._getResourceListWatchers(resource)
+        for watcher in list_watchers or []:
+            if self._isListWatcher(watcher):
+                self._queueListChange(watcher, resource)
+            else:
+                yield self._removeResourceListWatcher(resource, watcher)
+        yield defer.gatherResults(notifies, consumeErrors=True)
+
+    @defer.inlineCallbacks
+    def resourceListChanged(self, list_uri, added, removed):
+        # Watchers may be torn down while waiting for storage: iterate over
+        # a copy and skip them. Index entries left behind are dropped by
+        # statusChangedCallback.
+        for watcher in list(self._watchers_by_list.get(list_uri, ())):
+            w = ':'.join(watcher)
+            for resource in added:
+                if not self._isListWatcher(watcher):
+                    break
+                yield self.storage.sadd(self.LIST_WATCHERS_SET_NAME % resource, w)
+            for resource in removed:
+                if not self._isListWatcher(watcher):
+                    break
+                try:
+                    yield self._removeResourceListWatcher(resource, watcher)
+                except KeyError:
+                    pass
+            if self._isListWatcher(watcher):
+                self._queueListChange(watcher)
 
     @defer.inlineCallbacks
     def processSubscription(self, subscribe):
+        started_at = self.clock.seconds()
+        resource = ''
         expires = int(subscribe.headers['Expires'])
         if not expires and subscribe.dialog:
             watcher = subscribe.dialog.id
@@ -129,61 +227,210 @@ class SIPPresence(SIPUA):
             if not subscribe.ruri.user:
                 raise SIPError(404, 'Bad resource URI')
             resource = subscribe.ruri.user + '@' + subscribe.ruri.host
+            members = yield self.presence_service.getResourceList(resource)
+            if members and not self._supportsEventList(subscribe):
+                response = subscribe.createResponse(421, 'Extension Required')
+                response.headers['require'] = 'eventlist'
+                self.sendResponse(response)
+                defer.returnValue(None)
             yield self.createDialog(subscribe)
             watcher = subscribe.dialog.id
-            yield self.addWatcher(watcher, resource, expires)
+            if members:
+                yield self.addListWatcher(watcher, resource, members, expires)
+            else:
+                yield self.addWatcher(watcher, resource, expires)
             notify = yield self.createNotify(watcher, status='active', expires=expires, dialog=subscribe.dialog)
+        recorder.record(capture.SIP_SUBSCRIBE, started_at, ':'.join(watcher), resource, expires)
         response = subscribe.createResponse(200, 'OK')
         response.headers['Expires'] = str(expires)
+        if self._isListWatcher(watcher):
+            response.headers['require'] = 'eventlist'
         self.sendResponse(response)
         yield self.sendRequest(notify)
 
     @defer.inlineCallbacks
     def addWatcher(self, watcher, resource, expires):
         yield self._addResourceWatcher(resource, watcher)
-        yield self._setWatcherTimer(watcher, expires)
+        yield self._storeSubscription(watcher, resource, expires)
+
+    @defer.inlineCallbacks
+    def addListWatcher(self, watcher, list_uri, resources, expires):
+        w = ':'.join(watcher)
+        self._list_versions[watcher] = 0
+        for resource in resources:
+            yield self.storage.sadd(self.LIST_WATCHERS_SET_NAME % resource, w)
+        yield self._storeSubscription(watcher, list_uri, expires, is_list=True)
 
     @defer.inlineCallbacks
     def updateWatcher(self, watcher, expires):
-        if watcher not in self.watcher_expires_tid:
+        if watcher not in self.subscriptions:
             raise SIPError(500, "Server Internal Error")
-        yield self._setWatcherTimer(watcher, expires)
+        _, resource, is_list = self.subscriptions[watcher]
+        yield self._storeSubscription(watcher, resource, expires, is_list)
 
     @defer.inlineCallbacks
     def removeWatcher(self, watcher):
-        if watcher not in self.watcher_expires_tid:
+        if watcher not in self.subscriptions:
             raise SIPError(404, 'Not Found')
-        resource = yield self._getResourceByWatcher(watcher)
-        yield self._removeResourceWatcher(resource, watcher)
-        yield self.removeDialog(id=watcher)
-        yield self._cancelWatcherTimer(watcher)
+        yield self._teardownWatcher(watcher)
+
+    @defer.inlineCallbacks
+    def expireWatchers(self, watchers):
+        """
+        Tear down subscriptions and dialogs of expired watchers. Watchers
+        are processed in batches of WATCHER_EXPIRY_BATCH: teardowns of one
+        batch run concurrently, next batch is started on the next reactor
+        iteration. Watchers refreshed meanwhile are kept.
+        """
+        expiring = [(w, self.subscriptions[w][0]) for w in watchers if w in self.subscriptions]
+        for i in xrange(0, len(expiring), self.WATCHER_EXPIRY_BATCH):
+            if i:
+                yield task.deferLater(self.clock, 0, lambda: None)
+            batch = [w for w, expiresat in expiring[i:i + self.WATCHER_EXPIRY_BATCH]
+                    if w in self.subscriptions and self.subscriptions[w][0] == expiresat]
+            results = yield defer.DeferredList([self._teardownWatcher(w) for w in batch], consumeErrors=True)
+            for watcher, (success, r) in zip(batch, results):
+                if success:
+                    stats['sip_expired_watchers'] += 1
+                else:
+                    stats['sip_expiry_errors'] += 1
+                    log.err(r, "Failed to tear down expired watcher %r" % (watcher,))
 
     @defer.inlineCallbacks
     def createNotify(self, watcher, pidf=None, dialog=None, status='active', expires=None):
+        if pidf is None and self._isListWatcher(watcher):
+            notify = yield self.createListNotify(watcher, dialog=dialog, status=status, expires=expires)
+            defer.returnValue(notify)
         if pidf is None:
-            resource = yield self._getResourceByWatcher(watcher)
+            resource = self._getResourceByWatcher(watcher)
             statuses = yield self.presence_service.getStatus(resource)
             pidf = status2pidf(resource, statuses)
+        notify = yield self._createNotifyRequest(watcher, dialog, status, expires)
+        notify.headers['content-type'] = 'application/pidf+xml'
+        notify.content = pidf
+        defer.returnValue(notify)
+
+    @defer.inlineCallbacks
+    def createListNotify(self, watcher, resources=None, dialog=None, status='active', expires=None):
+        list_uri = self._getResourceByWatcher(watcher)
+        full_state = resources is None
+        if full_state:
+            resources = yield self.presence_service.getResourceList(list_uri)
+        documents = []
+        for resource in resources:
+            statuses = yield self.presence_service.getStatus(resource)
+            documents.append((resource, status2pidf(resource, statuses)))
+        version = self._list_versions.get(watcher, 0)
+        self._list_versions[watcher] = version + 1
+        yield self.storage.hset(self.LIST_VERSIONS, ':'.join(watcher), version + 1)
+        content_type, body = multipart_related(list_uri, version, full_state, documents)
+        notify = yield self._createNotifyRequest(watcher, dialog, status, expires)
+        notify.headers['content-type'] = content_type
+        notify.headers['require'] = 'eventlist'
+        notify.content = body
+        defer.returnValue(notify)
+
+    @defer.inlineCallbacks
+    def _createNotifyRequest(self, watcher, dialog, status, expires):
         if dialog is None:
             dialog = yield self.dialog_store.get(watcher)
             if not dialog:
                 raise SIPError(500, "Server Internal Error")
         if expires is None:
-            expires = self.watcher_expires_tid[watcher].getTime() - reactor.seconds()
+            expires = self.subscriptions[watcher][0] - self.clock.seconds()
             expires = int(expires)
         notify = dialog.createRequest('NOTIFY')
         h = notify.headers
         h['subscription-state'] = Header(status, {'expires': str(expires)})
-        h['content-type'] = 'application/pidf+xml'
         h['Event'] = 'presence'
-        notify.content = pidf
         defer.returnValue(notify)
 
     @defer.inlineCallbacks
     def notifyWatcher(self, watcher):
+        if watcher not in self.subscriptions:
+            return
         notify = yield self.createNotify(watcher)
         yield self.sendRequest(notify)
 
+    @defer.inlineCallbacks
+    def notifyListWatcher(self, watcher):
+        del self._list_notify_tid[watcher]
+        resources = self._list_changes.pop(watcher, None)
+        if watcher in self._list_full_state:
+            self._list_full_state.discard(watcher)
+            resources = None
+        elif not resources:
+            return
+        if not self._isListWatcher(watcher):
+            return
+        notify = yield self.createListNotify(watcher, resources=resources and sorted(resources))
+        yield self.sendRequest(notify)
+
+    def _queueListChange(self, watcher, resource=None):
+        """
+        Queue partial notification about resource, or full state
+        notification when resource is None (list members changed).
+        """
+        if resource is None:
+            self._list_full_state.add(watcher)
+        else:
+            self._list_changes.setdefault(watcher, set()).add(resource)
+        if watcher not in self._list_notify_tid:
+            self._list_notify_tid[watcher] = self.clock.callLater(self.LIST_NOTIFY_INTERVAL,
+                    self.notifyListWatcher, watcher)
+
+    def _supportsEventList(self, subscribe):
+        supported = subscribe.headers.get('supported') or ''
+        return 'eventlist' in [x.strip() for x in supported.split(',')]
+
+    def _teardownWatcher(self, watcher):
+        w = ':'.join(watcher)
+        expiresat, resource, is_list = self.subscriptions.pop(watcher)
+        self._unscheduleExpiry(watcher, expiresat)
+        if is_list:
+            watchers = self._watchers_by_list[resource]
+            watchers.discard(watcher)
+            if not watchers:
+                del self._watchers_by_list[resource]
+            d = self._removeListWatcher(watcher, resource)
+        else:
+            d = self._removeResourceWatcher(resource, watcher)
+        ops = [d, self.storage.hdel(self.SUBSCRIPTIONS, w), defer.maybeDeferred(self.removeDialog, id=watcher)]
+        return defer.gatherResults(ops, consumeErrors=True)
+
+    @defer.inlineCallbacks
+    def _removeListWatcher(self, watcher, list_uri):
+        if self._list_versions.pop(watcher, None):
+            yield self.storage.hdel(self.LIST_VERSIONS, ':'.join(watcher))
+        self._list_changes.pop(watcher, None)
+        self._list_full_state.discard(watcher)
+        tid = self._list_notify_tid.pop(watcher, None)
+        if tid and tid.active():
+            tid.cancel()
+        resources = yield self.presence_service.getResourceList(list_uri)
+        for resource in resources:
+            # Members added to the list are indexed after the list is stored
+            try:
+                yield self._removeResourceListWatcher(resource, watcher)
+            except KeyError:
+                pass
+
+    @defer.inlineCallbacks
+    def _getResourceListWatchers(self, resource):
+        s = self.LIST_WATCHERS_SET_NAME % resource
+        try:
+            watchers = yield self.storage.sgetall(s)
+        except KeyError:
+            defer.returnValue(None)
+        r = [tuple(w.split(':')) for w in watchers]
+        defer.returnValue(r)
+
+    @defer.inlineCallbacks
+    def _removeResourceListWatcher(self, resource, watcher):
+        s = self.LIST_WATCHERS_SET_NAME % resource
+        w = ':'.join(watcher)
+        yield self.storage.srem(s, w)
+
     @defer.inlineCallbacks
     def _getResourceWatchers(self, resource):
         s = self.WATCHERS_SET_NAME % resource
@@ -199,53 +446,98 @@ class SIPPresence(SIPUA):
         w = ':'.join(watcher)
         s = self.WATCHERS_SET_NAME % resource
         yield self.storage.sadd(s, w)
-        yield self.storage.hset(self.RESOURCE_BY_WATCHER, w, resource)
 
     @defer.inlineCallbacks
     def _removeResourceWatcher(self, resource, watcher):
         s = self.WATCHERS_SET_NAME % resource
         w = ':'.join(watcher)
         yield self.storage.srem(s, w)
-        yield self.storage.hdel(self.RESOURCE_BY_WATCHER, w)
 
-    @defer.inlineCallbacks
     def _getResourceByWatcher(self, watcher):
-        w = ':'.join(watcher)
-        r = yield self.storage.hget(self.RESOURCE_BY_WATCHER, w)
-        defer.returnValue(r)
+        if watcher not in self.subscriptions:
+            raise SIPError(404, 'Not Found')
+        return self.subscriptions[watcher][1]
+
+    def _isListWatcher(self, watcher):
+        subscription = self.subscriptions.get(watcher)
+        return subscription is not None and subscription[2]
 
     @defer.inlineCallbacks
-    def _setWatcherTimer(self, watcher, delay, memonly=False):
-        if watcher in self.watcher_expires_tid:
-            self.watcher_expires_tid[watcher].reset(delay)
-        else:
-            self.watcher_expires_tid[watcher] = reactor.callLater(delay, self.removeWatcher, watcher)
-        if not memonly:
-            w = ':'.join(watcher)
-            expiresat = reactor.seconds() + delay
-            yield self.storage.hset(self.WATCHER_TIMERS, w, expiresat)
+    def _storeSubscription(self, watcher, resource, expires, is_list=False):
+        expiresat = self.clock.seconds() + expires
+        self._rememberSubscription(watcher, expiresat, resource, is_list)
+        w = ':'.join(watcher)
+        yield self.storage.hset(self.SUBSCRIPTIONS, w, pack_subscription(expiresat, resource, is_list))
+
+    def _rememberSubscription(self, watcher, expiresat, resource, is_list):
+        if watcher in self.subscriptions:
+            self._unscheduleExpiry(watcher, self.subscriptions[watcher][0])
+        elif is_list:
+            self._watchers_by_list.setdefault(resource, set()).add(watcher)
+        self.subscriptions[watcher] = (expiresat, resource, is_list)
+        bucket = self._expiryBucket(expiresat)
+        if bucket not in self._expiry_buckets:
+            self._expiry_buckets[bucket] = set()
+            delay = max(0, bucket - self.clock.seconds())
+            self._expiry_tid[bucket] = self.clock.callLater(delay, self._expireBucket, bucket)
+        self._expiry_buckets[bucket].add(watcher)
+
+    def _unscheduleExpiry(self, watcher, expiresat):
+        bucket = self._expiryBucket(expiresat)
+        watchers = self._expiry_buckets.get(bucket)
+        if watchers is None:
+            return
+        watchers.discard(watcher)
+        if not watchers:
+            del self._expiry_buckets[bucket]
+            tid = self._expiry_tid.pop(bucket)
+            if tid.active():
+                tid.cancel()
+
+    def _expiryBucket(self, expiresat):
+        return int(math.ceil(expiresat))
+
+    def _expireBucket(self, bucket):
+        del self._expiry_tid[bucket]
+        watchers = self._expiry_buckets.pop(bucket)
+        return self.expireWatchers(watchers)
 
     @defer.inlineCallbacks
-    def _cancelWatcherTimer(self, watcher):
-        if watcher not in self.watcher_expires_tid:
+    def _loadSubscriptions(self):
+        yield self._convertLegacySubscriptions()
+        try:
+            records = yield self.storage.hgetall(self.SUBSCRIPTIONS)
+        except KeyError:
             defer.returnValue(None)
-        w = ':'.join(watcher)
-        yield self.storage.hdel(self.WATCHER_TIMERS, w)
-        tid = self.watcher_expires_tid.pop(watcher)
-        if tid.active():
-            tid.cancel()
+        for w, record in records.iteritems():
+            expiresat, resource, is_list = unpack_subscription(record)
+            self._rememberSubscription(tuple(w.split(':')), expiresat, resource, is_list)
+        try:
+            versions = yield self.storage.hgetall(self.LIST_VERSIONS)
+        except KeyError:
+            versions = {}
+        for w, version in versions.iteritems():
+            watcher = tuple(w.split(':'))
+            if self._isListWatcher(watcher):
+                self._list_versions[watcher] = int(version)
 
     @defer.inlineCallbacks
-    def _loadWatcherTimers(self):
+    def _convertLegacySubscriptions(self):
         try:
             timers = yield self.storage.hgetall(self.WATCHER_TIMERS)
         except KeyError:
             defer.returnValue(None)
+        by_watcher = {}
+        for key in (self.RESOURCE_BY_WATCHER, self.LIST_BY_WATCHER):
+            try:
+                by_watcher[key] = yield self.storage.hgetall(key)
+            except KeyError:
+                by_watcher[key] = {}
         for w, expiresat in timers.iteritems():
-            expires = float(expiresat) - reactor.seconds()
-            if expires <= 0:
-                yield self.storage.hdel(self.WATCHER_TIMERS, w)
-            else:
-                watcher = tuple(w.split(':'))
-                yield self._setWatcherTimer(watcher, expires, memonly=True)
-
+            for key, is_list in ((self.RESOURCE_BY_WATCHER, False), (self.LIST_BY_WATCHER, True)):
+                if w in by_watcher[key]:
+                    record = pack_subscription(float(expiresat), by_watcher[key][w], is_list)
+                    yield self.storage.hset(self.SUBSCRIPTIONS, w, record)
+                    yield self.storage.hdel(key, w)
+            yield self.storage.hdel(self.WATCHER_TIMERS, w)
+        log.msg("Converted %d subscriptions to %s" % (len(timers), self.SUBSCRIPTIONS))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from tippresence import utils
+
+CRLF = '\r\n'
+
+def resource_cid(host):
+    return '%s@%s' % (utils.random_str(10), host)
+
+def rlmi_document(list_uri, version, full_state, resources):
+    rlmi = []
+    a = rlmi.append
+    a('<?xml version="1.0" encoding="UTF-8"?>')
+    a('<list xmlns="urn:ietf:params:xml:ns:rlmi" uri="sip:%s" version="%d" fullState="%s">' %\
+            (list_uri, version, full_state and 'true' or 'false'))
+    for resource, cid in resources:
+        a('\t<resource uri="sip:%s">' % resource)
+        a('\t\t<instance id="%s" state="active" cid="%s"/>' % (resource, cid))
+        a('\t</resource>')
+    a('</list>')
+    return '\n'.join(rlmi)
+
+def multipart_related(list_uri, version, full_state, documents):
+    """
+    Build RFC 4662 multipart/related NOTIFY body. Documents is list of
+    (resource, pidf) pairs. Returns (content_type, body).
+    """
+    host = list_uri.split('@')[-1]
+    boundary = utils.random_str(20)
+    root_cid = resource_cid(host)
+    parts = [(resource, resource_cid(host), pidf) for resource, pidf in documents]
+    rlmi = rlmi_document(list_uri, version, full_state, [(r, cid) for r, cid, _ in parts])
+
+    body = []
+    a = body.append
+    def add_part(cid, content_type, content):
+        a('--' + boundary)
+        a('Content-Transfer-Encoding: binary')
+        a('Content-ID: <%s>' % cid)
+        a('Content-Type: %s;charset="UTF-8"' % content_type)
+        a('')
+        a(content)
+    add_part(root_cid, 'application/rlmi+xml', rlmi)
+    for _, cid, pidf in parts:
+        add_part(cid, 'application/pidf+xml', pidf)
+    a('--' + boundary + '--')
+    a('')
+
+    content_type = 'multipart/related;type="application/rlmi+xml";start="<%s>";boundary="%s"' %\
+            (root_cid, boundary)
+    return content_type, CRLF.join(body)
+
@@ -5,6 +5,7 @@ from datetime import datetime
 class Statistics(dict):
     def __init__(self):
         self.start_datetime = datetime.now()
+        self.sources = {}
         self.setUp()
 
     def setUp(self):
@@ -16,6 +17,13 @@ class Statistics(dict):
         self['presence_removed_statuses'] = 0
         self['presence_updated_statuses'] = 0
         self['presence_active_timers'] = 0
+        self['replication_sent'] = 0
+        self['replication_applied'] = 0
+        self['replication_rejected'] = 0
+        self['replication_unchanged'] = 0
+        self['replication_errors'] = 0
+        self['sip_expired_watchers'] = 0
+        self['sip_expiry_errors'] = 0
 
     def update_uptime(self):
         uptime = datetime.now() - self.start_datetime
@@ -25,6 +33,11 @@ class Statistics(dict):
         self.update()
         return self
 
+    def addSource(self, key, source):
+        self.sources[key] = source
+
     def update(self):
         self.update_uptime()
+        for key, source in self.sources.iteritems():
+            self[key] = source()
 
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+
+from twisted.internet import reactor, defer
+from twisted.python import log
+
+class Subscriber(object):
+    """
+    Bounded queue of status changes delivered to one watch() callback.
+
+    Callback may return deferred, at most `concurrency` deliveries are
+    in progress at the same time. With DROP_OLDEST policy the oldest
+    change is dropped when `maxsize` changes are queued. With COALESCE
+    policy queued change of the same resource is replaced by the new one
+    and nothing is dropped: queue holds at most one change per resource,
+    `maxsize` is not applied.
+    """
+    DROP_OLDEST = 'drop_oldest'
+    COALESCE = 'coalesce'
+
+    def __init__(self, name, callback, args=(), kwargs=None, maxsize=1000, overflow=COALESCE, concurrency=1,
+            clock=reactor):
+        if overflow not in (self.DROP_OLDEST, self.COALESCE):
+            raise ValueError("Unknown overflow policy: %r" % overflow)
+        self.name = name
+        self.clock = clock
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.concurrency = concurrency
+        self.running = 0
+        self._queue = deque()
+        self._queued = {}
+        self._dispatching = False
+        self.counters = {
+                'received': 0,
+                'delivered': 0,
+                'dropped': 0,
+                'coalesced': 0,
+                'errors': 0,
+                }
+        self.last_lag = 0
+        self.max_lag = 0
+
+    def put(self, resource, status):
+        self.counters['received'] += 1
+        if self.overflow == self.COALESCE and resource in self._queued:
+            self._queued[resource][1] = status
+            self.counters['coalesced'] += 1
+        else:
+            if self.overflow == self.DROP_OLDEST and len(self._queue) >= self.maxsize:
+                self._dropOldest()
+            entry = [resource, status, self.clock.seconds()]
+            self._queue.append(entry)
+            if self.overflow == self.COALESCE:
+                self._queued[resource] = entry
+        self._dispatch()
+
+    def depth(self):
+        return len(self._queue)
+
+    def lag(self):
+        if not self._queue:
+            return 0
+        return self.clock.seconds() - self._queue[0][2]
+
+    def dump(self):
+        r = dict(self.counters)
+        r['depth'] = self.depth()
+        r['running'] = self.running
+        r['lag'] = self.lag()
+        r['last_lag'] = self.last_lag
+        r['max_lag'] = self.max_lag
+        return r
+
+    def _dropOldest(self):
+        resource, _, _ = entry = self._queue.popleft()
+        if self._queued.get(resource) is entry:
+            del self._queued[resource]
+        self.counters['dropped'] += 1
+        log.msg("Subscriber %r queue overflow ==> change of resource %r dropped" % (self.name, resource))
+
+    def _dispatch(self):
+        if self._dispatching:
+            return
+        self._dispatching = True
+        try:
+            while self._queue and self.running < self.concurrency:
+                resource, status, enqueued_at = entry = self._queue.popleft()
+                if self._queued.get(resource) is entry:
+                    del self._queued[resource]
+                self.last_lag = self.clock.seconds() - enqueued_at
+                self.max_lag = max(self.max_lag, self.last_lag)
+                self.running += 1
+                d = defer.maybeDeferred(self.callback, resource, status, *self.args, **self.kwargs)
+                d.addCallbacks(self._delivered, self._failed, errbackArgs=(resource,))
+                d.addBoth(self._done)
+        finally:
+            self._dispatching = False
+
+    def _delivered(self, r):
+        self.counters['delivered'] += 1
+
+    def _failed(self, failure, resource):
+        self.counters['errors'] += 1
+        log.err(failure, "Subscriber %r failed to process change of resource %r" % (self.name, resource))
+
+    def _done(self, r):
+        self.running -= 1
+        self._dispatch()
+
@@ -0,0 +1,91 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from tipsip import MemoryStorage
+from tippresence import PresenceService
+from tippresence.replication import Replicator
+
+try:
+    from tippresence.amqp import AMQPReplicationTransport
+except ImportError:
+    AMQPReplicationTransport = None
+
+class Reply(object):
+    queue = 'amq.gen-1'
+    consumer_tag = 'ctag-1'
+
+class Message(object):
+    def __init__(self, body):
+        self.content = self
+        self.body = body
+
+class Channel(object):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: defer.succeed(Reply())
+
+class Broker(object):
+    """
+    AMQFactory and AMQClient of single node connected to fanout exchange.
+    """
+    def __init__(self):
+        self.client = self
+        self.published = []
+        self.incoming = defer.DeferredQueue()
+        self._on_connected = []
+
+    def addCallbackOnConnected(self, callback):
+        self._on_connected.append(callback)
+
+    def connect(self):
+        for callback in self._on_connected:
+            callback()
+
+    def publish(self, exchange, msg, routing_key):
+        self.published.append((exchange, msg, routing_key))
+        return defer.succeed(None)
+
+    def channel(self, channel_id):
+        return defer.succeed(Channel())
+
+    def queue(self, consumer_tag):
+        return defer.succeed(self)
+
+    def get(self):
+        return self.incoming.get().addCallback(Message)
+
+class AMQPReplicationTest(unittest.TestCase):
+    if AMQPReplicationTransport is None:
+        skip = "txamqp is not installed"
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.node1 = PresenceService(MemoryStorage(), self.clock)
+        self.node2 = PresenceService(MemoryStorage(), self.clock)
+        self.broker1 = Broker()
+        self.broker2 = Broker()
+        Replicator(self.node1, AMQPReplicationTransport(self.broker1), 'node1')
+        Replicator(self.node2, AMQPReplicationTransport(self.broker2), 'node2')
+
+    def deliver(self, src, dst):
+        for exchange, msg, routing_key in src.published:
+            self.assertEqual((exchange, routing_key), (AMQPReplicationTransport.exchange_name, ''))
+            dst.incoming.put(msg)
+            src.incoming.put(msg)
+        del src.published[:]
+
+    @defer.inlineCallbacks
+    def test_replication(self):
+        yield self.node1.putStatus('ivaxer@tipmeet.com', {"status": "online"}, expires=3600, tag='t')
+        del self.broker1.published[:]
+        self.broker1.connect()
+        self.broker2.connect()
+        self.assertEqual(len(self.broker1.published), 1)
+        self.assertEqual(self.broker2.published, [])
+        self.deliver(self.broker1, self.broker2)
+        r = yield self.node2.getStatus('ivaxer@tipmeet.com')
+        self.assertEqual(r[0][0], 't')
+
+        yield self.node2.removeStatus('ivaxer@tipmeet.com', 't')
+        self.deliver(self.broker2, self.broker1)
+        r = yield self.node1.getStatus('ivaxer@tipmeet.com')
+        self.assertEqual(r, [])
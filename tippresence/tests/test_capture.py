@@ -0,0 +1,104 @@
+import os
+from StringIO import StringIO
+
+from twisted.trial import unittest
+
+from tipsip import MemoryStorage
+from tippresence import PresenceService
+from tippresence import capture
+from tippresence.capture import Recorder, read_capture, CaptureError
+from tippresence.clock import VirtualClock
+from tippresence.http import HTTPPresence
+from tippresence.sip.loopback import LoopbackSIPPresence, publish_request
+from tippresence.tools.replay import Replayer
+
+PIDF = '''<presence xmlns="urn:ietf:params:xml:ns:pidf" entity="sip:ivaxer@tipmeet.com">
+<tuple id="t"><status><basic>open</basic></status></tuple></presence>'''
+
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        recorder = Recorder()
+        recorder.record(capture.HTTP_GET, 0, 'john@tipmeet.com')
+        recorder.start(self.path)
+        recorder.record(capture.SIP_SUBSCRIBE, 100.0, 'call:from:to', 'ivaxer@tipmeet.com', 3600)
+        recorder.record(capture.SIP_PUBLISH, 100.5, 'ivaxer@tipmeet.com', '', 'etag', 3600, PIDF)
+        recorder.record(capture.HTTP_PUT, 160.0, 'john@tipmeet.com', 'tag', {'status': 'online'}, 3600, 0)
+        recorder.record(capture.SIP_PUBLISH, 220.0, 'ivaxer@tipmeet.com', 'etag', 'etag', 0, '')
+        recorder.record(capture.HTTP_REMOVE, 230.0, 'john@tipmeet.com', 'unknown')
+        recorder.stop()
+        self.assertEqual(recorder.records, 5)
+        self.clock = VirtualClock()
+        self.presence = PresenceService(MemoryStorage(), self.clock)
+
+    def test_readCapture(self):
+        records = list(read_capture(self.path))
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[0], (100.0, capture.SIP_SUBSCRIBE, ('call:from:to', 'ivaxer@tipmeet.com', 3600)))
+        self.assertEqual(records[2][2][2], {'status': 'online'})
+
+    def test_truncated(self):
+        size = os.path.getsize(self.path)
+        f = open(self.path, 'r+b')
+        f.truncate(size - 1)
+        f.close()
+        self.assertRaises(CaptureError, list, read_capture(self.path))
+
+    def test_replayVirtual(self):
+        replayer = Replayer(self.presence, self.clock, speed=10)
+        reports = []
+        replayer.runVirtual(read_capture(self.path)).addCallback(reports.append)
+        report = reports[0]
+        self.assertEqual(report['operations'], 5)
+        self.assertEqual(report['capture_seconds'], 130.0)
+        self.assertEqual(report['events']['sip_publish']['count'], 2)
+        self.assertEqual(report['events']['http_remove']['count'], 1)
+        self.assertEqual(report['notifies'], 3)
+        self.assertEqual(self.presence.getResources('tipmeet.com'), [])
+        self.assertEqual(self.presence._status_timers, {})
+
+
+    def test_replayRoster(self):
+        path = self.mktemp()
+        recorder = Recorder()
+        recorder.start(path)
+        recorder.record(capture.HTTP_PUT_LIST, 10.0, 'buddies@tipmeet.com', ['ivaxer@tipmeet.com', 'john@tipmeet.com'])
+        recorder.record(capture.SIP_SUBSCRIBE, 20.0, 'call:from:to', 'buddies@tipmeet.com', 600)
+        recorder.record(capture.SIP_PUBLISH, 30.0, 'ivaxer@tipmeet.com', '', 'etag', 3600, PIDF)
+        recorder.record(capture.SIP_PUBLISH, 40.0, 'ivaxer@tipmeet.com', 'etag', 'etag', 3600, '')
+        recorder.record(capture.SIP_SUBSCRIBE, 50.0, 'call:from:to', '', 0)
+        recorder.record(capture.HTTP_REMOVE_LIST, 60.0, 'buddies@tipmeet.com')
+        recorder.stop()
+        replayer = Replayer(self.presence, self.clock)
+        reports = []
+        replayer.runVirtual(read_capture(path)).addCallback(reports.append)
+        report = reports[0]
+        self.assertEqual(sum(e['errors'] for e in report['events'].itervalues()), 0)
+        self.assertEqual(report['notifies'], 4)
+        self.assertEqual(replayer.sip.subscriptions, {})
+        self.assertEqual(replayer.dialogs, {})
+
+    def test_captureFailures(self):
+        path = self.mktemp()
+        capture.recorder.start(path)
+        self.addCleanup(capture.recorder.stop)
+        sip = LoopbackSIPPresence(self.presence.storage, self.presence, self.clock)
+        d = sip.handle_PUBLISH(publish_request('ivaxer@tipmeet.com', None, 3600, 'stale'))
+        self.failureResultOf(d)
+        replies = []
+        http = HTTPPresence(self.presence)
+        content = StringIO('{"presence": {"status": "online"}, "expires": 1000000}')
+        http.putStatus(replies.append, lambda: None, 'john@tipmeet.com', content, tag='t')
+        self.assertTrue('failure' in replies[0])
+        capture.recorder.stop()
+
+        records = list(read_capture(path))
+        self.assertEqual([(event, fields[:3]) for _, event, fields in records], [
+            (capture.SIP_PUBLISH, ('ivaxer@tipmeet.com', 'stale', '')),
+            (capture.HTTP_PUT, ('john@tipmeet.com', 't', {'status': 'online'})),
+            ])
+        replayer = Replayer(self.presence, self.clock, sip=sip)
+        reports = []
+        replayer.runVirtual(records).addCallback(reports.append)
+        events = reports[0]['events']
+        self.assertEqual((events['sip_publish']['errors'], events['http_put']['errors']), (1, 1))
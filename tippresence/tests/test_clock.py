@@ -0,0 +1,53 @@
+from twisted.trial import unittest
+from twisted.internet.error import AlreadyCalled, AlreadyCancelled
+
+from tippresence.clock import VirtualClock
+
+class VirtualClockTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.calls = []
+
+    def call(self, x):
+        self.calls.append((self.clock.seconds(), x))
+
+    def test_advance(self):
+        self.clock.callLater(2, self.call, 'b')
+        self.clock.callLater(1, self.call, 'a')
+        self.clock.callLater(3, self.call, 'c')
+        self.clock.advance(2)
+        self.assertEqual(self.calls, [(2, 'a'), (2, 'b')])
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+    def test_resetAndCancel(self):
+        a = self.clock.callLater(1, self.call, 'a')
+        b = self.clock.callLater(5, self.call, 'b')
+        c = self.clock.callLater(2, self.call, 'c')
+        a.reset(4)
+        b.reset(3)
+        c.cancel()
+        self.assertEqual(sorted(x.getTime() for x in self.clock.getDelayedCalls()), [3, 4])
+        self.clock.run()
+        self.assertEqual(self.calls, [(3, 'b'), (4, 'a')])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_runUntil(self):
+        def reschedule():
+            self.call('tick')
+            self.clock.callLater(60, reschedule)
+        self.clock.callLater(60, reschedule)
+        self.clock.run(until=3600)
+        self.assertEqual(len(self.calls), 60)
+        self.assertEqual(self.clock.seconds(), 3600)
+
+
+    def test_calledAndCancelled(self):
+        a = self.clock.callLater(1, self.call, 'a')
+        b = self.clock.callLater(1, self.call, 'b')
+        b.cancel()
+        self.assertRaises(AlreadyCancelled, b.reset, 1)
+        a.delay(1)
+        self.clock.advance(2)
+        self.assertEqual(self.calls, [(2, 'a')])
+        self.assertFalse(a.active())
+        self.assertRaises(AlreadyCalled, a.cancel)
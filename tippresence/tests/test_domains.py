@@ -0,0 +1,55 @@
+import json
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.web.test.requesthelper import DummyRequest
+
+from tipsip import MemoryStorage
+from tippresence import PresenceService
+from tippresence.http import HTTPDomains
+
+class HTTPDomainsTest(unittest.TestCase):
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.presence = PresenceService(MemoryStorage(), task.Clock())
+        self.resource = HTTPDomains(self.presence)
+        for user in ('a', 'b', 'c'):
+            yield self.presence.putStatus(user + '@tipmeet.com', {"status": "online"}, expires=3600, tag='t')
+        yield self.presence.putStatus('d@example.com', {"status": "offline"}, expires=3600, tag='t')
+
+    def get(self, path, **args):
+        request = DummyRequest(path.split('/'))
+        request.args = dict((name, [str(value)]) for name, value in args.iteritems())
+        return json.loads(self.resource.render_GET(request))
+
+    def test_countByDomain(self):
+        r = self.get('')
+        self.assertEqual(r['result'], {'tipmeet.com': 3})
+        r = self.get('', status='offline')
+        self.assertEqual(r['result'], {'example.com': 1})
+
+    def test_count(self):
+        r = self.get('tipmeet.com')
+        self.assertEqual((r['status'], r['result']), ('ok', {'count': 3}))
+        r = self.get('example.com')
+        self.assertEqual(r['result'], {'count': 0})
+
+    def test_resources(self):
+        r = self.get('tipmeet.com/resources')
+        self.assertEqual(r['result'], {'count': 3, 'offset': 0, 'resources': ['a@tipmeet.com', 'b@tipmeet.com', 'c@tipmeet.com']})
+        r = self.get('tipmeet.com/resources', offset=1, limit=1)
+        self.assertEqual(r['result'], {'count': 3, 'offset': 1, 'resources': ['b@tipmeet.com']})
+        r = self.get('tipmeet.com/resources', offset=5)
+        self.assertEqual(r['result']['resources'], [])
+
+    def test_invalidArguments(self):
+        for args in [{'offset': 'x'}, {'limit': 'x'}, {'offset': -1}, {'limit': 0},
+                {'limit': HTTPDomains.MAX_LIMIT + 1}]:
+            r = self.get('tipmeet.com/resources', **args)
+            self.assertEqual(r['status'], 'failure')
+        r = self.get('tipmeet.com/resources', limit=HTTPDomains.MAX_LIMIT)
+        self.assertEqual(r['status'], 'ok')
+
+    def test_invalidURI(self):
+        r = self.get('tipmeet.com/unknown')
+        self.assertEqual(r, {'status': 'failure', 'reason': 'Invalid URI'})
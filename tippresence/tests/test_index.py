@@ -0,0 +1,47 @@
+import random
+
+from twisted.trial import unittest
+
+from tippresence.index import SortedMembers, StatusIndex
+
+class SortedMembersTest(unittest.TestCase):
+    def setUp(self):
+        self.members = SortedMembers()
+        self.members.BLOCK = 4
+
+    def test_addRemove(self):
+        items = ['user%03d' % i for i in range(100)]
+        shuffled = items[:]
+        random.Random(1).shuffle(shuffled)
+        for item in shuffled:
+            self.members.add(item)
+        self.assertEqual(len(self.members), 100)
+        self.assertEqual(self.members.slice(), items)
+        for item in shuffled[:50]:
+            self.members.remove(item)
+        self.assertEqual(self.members.slice(), sorted(shuffled[50:]))
+        for item in shuffled[50:]:
+            self.members.remove(item)
+        self.assertEqual(len(self.members), 0)
+        self.assertEqual(self.members.slice(), [])
+
+    def test_slice(self):
+        items = ['user%03d' % i for i in range(30)]
+        for item in items:
+            self.members.add(item)
+        for offset, limit in [(0, 10), (7, 5), (8, 1), (25, 10), (30, 5), (3, None)]:
+            expected = items[offset:] if limit is None else items[offset:offset + limit]
+            self.assertEqual(self.members.slice(offset, limit), expected)
+
+class StatusIndexTest(unittest.TestCase):
+    def test_update(self):
+        index = StatusIndex()
+        index.update('a@x.com', 'online')
+        index.update('b@x.com', 'online')
+        index.update('a@x.com', 'offline')
+        self.assertEqual(index.members('x.com', 'online'), ['b@x.com'])
+        self.assertEqual(index.members('x.com', 'offline'), ['a@x.com'])
+        index.remove('b@x.com')
+        self.assertEqual(index.count('x.com', 'online'), 0)
+        self.assertEqual(index.countByDomain('online'), {})
+        self.assertEqual(index.members('x.com', 'online'), [])
@@ -0,0 +1,51 @@
+from twisted.trial import unittest
+from twisted.internet import reactor, defer
+
+from tipsip import MemoryStorage
+from tippresence import PresenceService
+from tippresence.http import HTTPAdmin
+from tippresence.introspection import SamplingProfiler, ProfilerError, RequestLog, approx_size, describe
+from tippresence.sip.loopback import LoopbackSIPPresence
+
+class IntrospectionTest(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_profiler(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start(0.05)
+        self.assertRaises(ProfilerError, profiler.start, 1)
+        d = defer.Deferred()
+        reactor.callLater(0.1, d.callback, None)
+        yield d
+        r = profiler.result()
+        self.assertFalse(r['running'])
+        self.assertTrue(r['samples'] > 0)
+        self.assertEqual(sum(s['count'] for s in r['stacks']), r['samples'])
+
+    def test_requestLog(self):
+        log = RequestLog(size=2)
+        log.record('http', 'GET /', reactor.seconds())
+        log.enabled = True
+        for name, started_at in [('a', 3), ('b', 1), ('c', 2)]:
+            log.record('http', name, reactor.seconds() - started_at)
+        self.assertEqual([r['name'] for r in log.slowest()], ['c', 'b'])
+
+    def test_approxSize(self):
+        self.assertTrue(approx_size({'a': 'x' * 1000}) > 1000)
+
+    def test_describe(self):
+        d = dict((i, 'x' * 100) for i in xrange(1000))
+        r = describe(d, sample=10)
+        self.assertEqual(r['entries'], 1000)
+        self.assertEqual(r['approx_bytes'], approx_size(d))
+        self.assertEqual(describe([]), {'entries': 0, 'approx_bytes': approx_size([])})
+
+    def test_memory(self):
+        storage = MemoryStorage()
+        presence = PresenceService(storage, reactor)
+        sip = LoopbackSIPPresence(storage, presence)
+        r = HTTPAdmin(presence, sip).memory()
+        for key in ('status_timers', 'status_index', 'tombstones', 'subscriptions', 'expiry_buckets', 'pidf_cache'):
+            self.assertEqual(r[key]['entries'], 0)
+        self.assertEqual(r['subscribers'], {'sip': 0})
+        self.assertEqual(r['dialogs']['entries'], 0)
+        self.assertEqual(r['storage'], None)
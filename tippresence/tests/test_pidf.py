@@ -0,0 +1,76 @@
+from twisted.trial import unittest
+
+from tippresence.pidf import parse_pidf, PIDFCache, PIDFError, MAX_PIDF_SIZE
+
+PIDF = '''<?xml version="1.0" encoding="UTF-8"?>
+<p:presence xmlns:p="urn:ietf:params:xml:ns:pidf"
+    xmlns:dm="urn:ietf:params:xml:ns:pidf:data-model"
+    xmlns:rpid="urn:ietf:params:xml:ns:pidf:rpid"
+    entity="sip:ivaxer@tipmeet.com">
+  <p:tuple id="t1">
+    <p:status><p:basic>closed</p:basic></p:status>
+  </p:tuple>
+  <p:tuple id="t2">
+    <p:status>
+      <p:basic> %s </p:basic>
+    </p:status>
+  </p:tuple>
+  <dm:person id="p1">
+    <rpid:activities>
+      <rpid:note>Lunch</rpid:note>
+      <rpid:meal/>
+    </rpid:activities>
+    <dm:note>Out for lunch</dm:note>
+  </dm:person>
+</p:presence>
+'''
+
+class PIDFTest(unittest.TestCase):
+    def test_parse(self):
+        r = parse_pidf(PIDF % 'open')
+        self.assertEqual(r, {'status': 'online', 'note': 'Out for lunch', 'activities': ['meal']})
+
+    def test_closed(self):
+        r = parse_pidf(PIDF % 'closed')
+        self.assertEqual(r['status'], 'offline')
+
+    def test_foreignNamespace(self):
+        r = parse_pidf('<presence><tuple><status><basic>open</basic></status></tuple></presence>')
+        self.assertEqual(r, {'status': 'offline'})
+
+    def test_malformed(self):
+        self.assertRaises(PIDFError, parse_pidf, '<presence>')
+        self.assertRaises(PIDFError, parse_pidf, '<!DOCTYPE presence []><presence/>')
+
+    def test_sizeLimit(self):
+        self.assertRaises(PIDFError, parse_pidf, ' ' * (MAX_PIDF_SIZE + 1))
+
+
+    def test_cache(self):
+        online, offline = PIDF % 'open', PIDF % 'closed'
+        cache = PIDFCache(max_bytes=2 * len(online) + 10)
+        r = cache.parse(online)
+        r['status'] = 'away'
+        self.assertEqual(cache.parse(online[:-1] + online[-1])['status'], 'online')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.parse(offline)
+        cache.parse(online)
+        cache.parse('<presence/>')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.bytes, len(online) + len('<presence/>'))
+        cache.parse(online)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertRaises(PIDFError, cache.parse, '<presence>')
+        self.assertEqual(len(cache), 2)
+
+    def test_cacheKeyCollision(self):
+        cache = PIDFCache()
+        padding = '<!--%s-->' % ('x' * PIDFCache.KEY_BYTES)
+        online = (PIDF % 'open').replace('<p:tuple', padding + '<p:tuple', 1)
+        offline = (PIDF % 'clos').replace('<p:tuple', padding + '<p:tuple', 1)
+        self.assertEqual(len(online), len(offline))
+        self.assertEqual(cache.parse(online)['status'], 'online')
+        self.assertEqual(cache.parse(offline)['status'], 'offline')
+        self.assertEqual(cache.parse(online)['status'], 'online')
+        self.assertEqual((len(cache), cache.hits, cache.misses), (1, 0, 3))
+        self.assertEqual(cache.bytes, len(online))
@@ -1,5 +1,5 @@
 from twisted.trial import unittest
-from twisted.internet import reactor, defer
+from twisted.internet import defer, task
 
 import json
 
@@ -8,7 +8,8 @@ from tippresence import PresenceService
 
 class PresenceServerTest(unittest.TestCase):
     def setUp(self):
-        self.presence = PresenceService(MemoryStorage())
+        self.clock = task.Clock()
+        self.presence = PresenceService(MemoryStorage(), self.clock)
 
     @defer.inlineCallbacks
     def test_removeStatus(self):
@@ -27,9 +28,7 @@ class PresenceServerTest(unittest.TestCase):
         yield self.presence.putStatus('ivaxer@tipmeet.com', '', tag='forwarding', expires=0.01)
         yield self.presence.putStatus('ivaxer@tipmeet.com', '', tag='calendar', expires=0.01)
         yield self.presence.putStatus('ivaxer@tipmeet.com', '', tag='rand', expires=0.01)
-        d = defer.Deferred()
-        reactor.callLater(0.02, d.callback, None)
-        yield d
+        self.clock.advance(0.02)
         s = yield self.presence.getStatus('ivaxer@tipmeet.com')
         self.assertEqual(s, [])
 
@@ -57,11 +56,61 @@ class PresenceServerTest(unittest.TestCase):
 
     @defer.inlineCallbacks
     def test_statusLoadStore(self):
-        d = defer.Deferred()
         yield self.presence._storeStatusTimer('ivaxer@tipmeet.com', 'tag', 0.01)
         yield self.presence._loadStatusTimers()
         self.assertTrue(self.presence._status_timers['ivaxer@tipmeet.com', 'tag'].active())
-        reactor.callLater(0.02, lambda: d.callback(len(self.presence._status_timers)))
-        d.addCallback(self.assertEqual, 0)
-        yield d
+        self.clock.advance(0.02)
+        self.assertEqual(len(self.presence._status_timers), 0)
+
+    @defer.inlineCallbacks
+    def test_expiresSimulation(self):
+        aq = self.assertEqual
+        for i in range(200):
+            yield self.presence.putStatus('user%d@tipmeet.com' % i, {"status": "online"}, expires=90 + i * 15, tag='t')
+        aq(self.presence.countResources('tipmeet.com'), 200)
+        for minute in range(60):
+            for i in range(0, 200, 2):
+                yield self.presence.updateStatus('user%d@tipmeet.com' % i, 't', 90 + i * 15)
+            self.clock.advance(60)
+        aq(self.presence.countResources('tipmeet.com'), 100)
+        self.clock.advance(self.presence.MAX_EXPIRE_TIME)
+        aq(self.presence.countResources('tipmeet.com'), 0)
+        aq(len(self.presence._status_timers), 0)
+
+    @defer.inlineCallbacks
+    def test_resourceList(self):
+        aq = self.assertEqual
+        yield self.presence.putResourceList('buddies@tipmeet.com', ['ivaxer@tipmeet.com', 'john@tipmeet.com'])
+        r = yield self.presence.getResourceList('buddies@tipmeet.com')
+        aq(sorted(r), ['ivaxer@tipmeet.com', 'john@tipmeet.com'])
+        yield self.presence.putResourceList('buddies@tipmeet.com', ['john@tipmeet.com'])
+        r = yield self.presence.getResourceList('buddies@tipmeet.com')
+        aq(r, ['john@tipmeet.com'])
+        r = yield self.presence.removeResourceList('buddies@tipmeet.com')
+        aq(r, 'ok')
+        r = yield self.presence.getResourceList('buddies@tipmeet.com')
+        aq(r, [])
+        r = yield self.presence.removeResourceList('buddies@tipmeet.com')
+        aq(r, 'not_found')
+
+    @defer.inlineCallbacks
+    def test_domainIndex(self):
+        aq = self.assertEqual
+        yield self.presence.putStatus('ivaxer@tipmeet.com', {"status": "online"},  expires=3600, tag='t1')
+        yield self.presence.putStatus('john@tipmeet.com', {"status": "online"},  expires=3600, tag='t1')
+        yield self.presence.putStatus('john@tipmeet.com', {"status": "offline"},  expires=3600, tag='t2')
+        yield self.presence.putStatus('bob@example.com', {"status": "offline"},  expires=3600, tag='t1')
+        aq(self.presence.countResources('tipmeet.com'), 2)
+        aq(self.presence.countResources('example.com'), 0)
+        aq(self.presence.countResources('example.com', 'offline'), 1)
+        aq(self.presence.countResourcesByDomain(), {'tipmeet.com': 2})
+        aq(self.presence.getResources('tipmeet.com'), ['ivaxer@tipmeet.com', 'john@tipmeet.com'])
+        aq(self.presence.getResources('tipmeet.com', offset=1, limit=1), ['john@tipmeet.com'])
+        yield self.presence.removeStatus('ivaxer@tipmeet.com', 't1')
+        aq(self.presence.getResources('tipmeet.com'), ['john@tipmeet.com'])
+        yield self.presence.removeStatus('john@tipmeet.com', 't1')
+        aq(self.presence.countResources('tipmeet.com'), 0)
+        aq(self.presence.getResources('tipmeet.com', 'offline'), ['john@tipmeet.com'])
+        yield self.presence.removeStatus('john@tipmeet.com', 't2')
+        yield self.presence.removeStatus('bob@example.com', 't1')
 
@@ -0,0 +1,107 @@
+import json
+
+from twisted.trial import unittest
+from twisted.internet import reactor, defer, task
+
+from tipsip import MemoryStorage
+from tippresence import PresenceService, Status
+from tippresence.replication import Replicator, LoopbackTransport, TCPTransport
+
+class ReplicationTest(unittest.TestCase):
+    def setUp(self):
+        hub = []
+        self.clock = task.Clock()
+        self.node1 = PresenceService(MemoryStorage(), self.clock)
+        self.node2 = PresenceService(MemoryStorage(), self.clock)
+        self.replicator1 = Replicator(self.node1, LoopbackTransport(hub), 'node1')
+        self.replicator2 = Replicator(self.node2, LoopbackTransport(hub), 'node2')
+
+    @defer.inlineCallbacks
+    def test_putStatus(self):
+        changes = []
+        self.node2.watch(lambda resource, status: changes.append(resource))
+        yield self.node1.putStatus('ivaxer@tipmeet.com', {"status": "online"}, expires=3600, tag='t')
+        r = yield self.node2.getStatus('ivaxer@tipmeet.com')
+        self.assertEqual(len(r), 1)
+        tag, status = r[0]
+        self.assertEqual(tag, 't')
+        self.assertEqual(status['presence'], {'status': 'online'})
+        self.assertEqual(changes, ['ivaxer@tipmeet.com'])
+        self.assertEqual(self.node2.countResources('tipmeet.com'), 1)
+
+    @defer.inlineCallbacks
+    def test_removeStatus(self):
+        yield self.node1.putStatus('ivaxer@tipmeet.com', {"status": "online"}, expires=3600, tag='t')
+        yield self.node2.removeStatus('ivaxer@tipmeet.com', 't')
+        r = yield self.node1.getStatus('ivaxer@tipmeet.com')
+        self.assertEqual(r, [])
+
+    @defer.inlineCallbacks
+    def test_conflicts(self):
+        yield self.node1.putStatus('ivaxer@tipmeet.com', {"status": "online"}, expires=3600, tag='t')
+        status = Status({"status": "offline"}, self.clock.seconds() + 60, 0)
+        r = yield self.node2.applyStatus('ivaxer@tipmeet.com', 't', status)
+        self.assertEqual(r, 'stale')
+        r = yield self.node2.applyRemoval('ivaxer@tipmeet.com', 't', self.clock.seconds())
+        self.assertEqual(r, 'stale')
+        r = yield self.node2.getStatus('ivaxer@tipmeet.com')
+        self.assertEqual(r[0][1]['presence'], {'status': 'online'})
+        yield self.node1.removeStatus('ivaxer@tipmeet.com', 't')
+
+    @defer.inlineCallbacks
+    def test_snapshot(self):
+        changes = []
+        self.node2.watch(lambda resource, status: changes.append(resource))
+        yield self.node1.putStatus('ivaxer@tipmeet.com', {"status": "online"}, expires=3600, tag='t1')
+        yield self.node2.putStatus('john@tipmeet.com', {"status": "online"}, expires=3600, tag='t2')
+        msgs = yield self.replicator2.snapshot()
+        self.assertEqual([json.loads(m)['resource'] for m in msgs], ['john@tipmeet.com'])
+        del changes[:]
+        msgs = yield self.replicator1.snapshot()
+        for msg in msgs:
+            yield self.replicator2.messageReceived(msg)
+        self.assertEqual(changes, [])
+        yield self.node1.removeStatus('ivaxer@tipmeet.com', 't1')
+        yield self.node2.removeStatus('john@tipmeet.com', 't2')
+
+    @defer.inlineCallbacks
+    def test_putAfterRemoval(self):
+        status = Status({"status": "online"}, self.clock.seconds() + 60, 0)
+        r = yield self.node2.applyRemoval('ivaxer@tipmeet.com', 't', status['expiresat'], removed_at=10)
+        self.assertEqual(r, 'not_found')
+        r = yield self.node2.applyStatus('ivaxer@tipmeet.com', 't', status, updated_at=5)
+        self.assertEqual(r, 'stale')
+        r = yield self.node2.getStatus('ivaxer@tipmeet.com')
+        self.assertEqual(r, [])
+        r = yield self.node2.applyStatus('ivaxer@tipmeet.com', 't', status, updated_at=15)
+        self.assertEqual(r, 'ok')
+        yield self.node2.removeStatus('ivaxer@tipmeet.com', 't', replicate=False)
+
+    def test_tombstonesExpire(self):
+        self.node2.applyRemoval('ivaxer@tipmeet.com', 't', self.clock.seconds() + 60)
+        self.assertEqual(len(self.node2._tombstones), 1)
+        self.clock.advance(61)
+        self.node2.applyRemoval('john@tipmeet.com', 't', self.clock.seconds() + 60)
+        self.assertEqual(self.node2._tombstones.keys(), [('john@tipmeet.com', 't')])
+
+    @defer.inlineCallbacks
+    def test_tcpTransport(self):
+        node3 = PresenceService(MemoryStorage(), self.clock)
+        node4 = PresenceService(MemoryStorage(), self.clock)
+        yield node3.putStatus('ivaxer@tipmeet.com', {"status": "online"}, expires=3600, tag='t1')
+        t3 = TCPTransport(0)
+        t4 = TCPTransport(0)
+        Replicator(node3, t3, 'node3')
+        Replicator(node4, t4, 'node4')
+        self.addCleanup(t3.stop)
+        self.addCleanup(t4.stop)
+        t3.addPeer('127.0.0.1', t4.listening_port.getHost().port)
+        yield node3.putStatus('john@tipmeet.com', {"status": "online"}, expires=3600, tag='t2')
+        for i in range(100):
+            if node4.countResources('tipmeet.com') == 2:
+                break
+            d = defer.Deferred()
+            reactor.callLater(0.01, d.callback, None)
+            yield d
+        self.assertEqual(node4.getResources('tipmeet.com'), ['ivaxer@tipmeet.com', 'john@tipmeet.com'])
+
@@ -0,0 +1,21 @@
+from twisted.trial import unittest
+
+from tippresence.sip.rlmi import multipart_related
+
+class RLMITest(unittest.TestCase):
+    def test_multipartRelated(self):
+        docs = [('ivaxer@tipmeet.com', '<presence/>'), ('john@tipmeet.com', '<presence/>')]
+        content_type, body = multipart_related('buddies@tipmeet.com', 3, False, docs)
+        self.assertTrue(content_type.startswith('multipart/related;type="application/rlmi+xml"'))
+        boundary = content_type.split('boundary="')[1][:-1]
+        parts = body.split('--' + boundary)
+        self.assertEqual(parts[-1], '--\r\n')
+        self.assertEqual(len(parts), 5)
+        rlmi = parts[1]
+        self.assertTrue('Content-Type: application/rlmi+xml' in rlmi)
+        self.assertTrue('uri="sip:buddies@tipmeet.com" version="3" fullState="false"' in rlmi)
+        for resource, _ in docs:
+            self.assertTrue('<resource uri="sip:%s">' % resource in rlmi)
+        start = content_type.split('start="<')[1].split('>"')[0]
+        self.assertTrue('Content-ID: <%s>' % start in rlmi)
+
@@ -0,0 +1,288 @@
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from tipsip import MemoryStorage, SIPError
+from tippresence import PresenceService
+from tippresence import stats
+from tippresence.clock import VirtualClock
+from tippresence.sip.loopback import LoopbackSIPPresence, publish_request, subscribe_request
+from tippresence.sip.presence import pack_subscription
+
+class PausingStorage(MemoryStorage):
+    """
+    MemoryStorage delaying additions to list watcher sets while `pause` is set.
+    """
+    def __init__(self):
+        MemoryStorage.__init__(self)
+        self.pause = False
+        self.paused = []
+
+    def sadd(self, key, value):
+        if self.pause and key.startswith('sys:list_watchers_by_resource:'):
+            d = defer.Deferred()
+            d.addCallback(lambda _: MemoryStorage.sadd(self, key, value))
+            self.paused.append((value, d))
+            return d
+        return MemoryStorage.sadd(self, key, value)
+
+    def resume(self):
+        self.pause = False
+        while self.paused:
+            _, d = self.paused.pop(0)
+            d.callback(None)
+
+class ResourceListSubscriptionTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1000)
+        self.storage = MemoryStorage()
+        self.presence = PresenceService(self.storage, self.clock)
+        self.sip = LoopbackSIPPresence(self.storage, self.presence, self.clock)
+
+    @defer.inlineCallbacks
+    def subscribe(self, uri, expires=600, eventlist=True):
+        yield self.sip.handle_SUBSCRIBE(subscribe_request(uri, expires, eventlist=eventlist))
+        defer.returnValue(self.sip.responses[-1])
+
+    def notifies(self):
+        notifies = self.sip.requests
+        self.sip.requests = []
+        return [n.content for n in notifies]
+
+    @defer.inlineCallbacks
+    def test_subscribe(self):
+        yield self.presence.putResourceList('buddies@x.com', ['a@x.com'])
+        response = yield self.subscribe('buddies@x.com')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['require'], 'eventlist')
+        [body] = self.notifies()
+        self.assertTrue('version="0" fullState="true"' in body)
+        self.assertTrue('<resource uri="sip:a@x.com">' in body)
+
+        yield self.presence.putStatus('a@x.com', {'status': 'online'}, 600, tag='t')
+        self.clock.advance(self.sip.LIST_NOTIFY_INTERVAL)
+        [body] = self.notifies()
+        self.assertTrue('version="1" fullState="false"' in body)
+        self.assertTrue('<basic>open</basic>' in body)
+
+    @defer.inlineCallbacks
+    def test_subscribeWithoutEventlist(self):
+        yield self.presence.putResourceList('buddies@x.com', ['a@x.com'])
+        response = yield self.subscribe('buddies@x.com', eventlist=False)
+        self.assertEqual(response.code, 421)
+        self.assertEqual(self.sip.subscriptions, {})
+
+    @defer.inlineCallbacks
+    def test_membersChanged(self):
+        yield self.presence.putResourceList('buddies@x.com', ['a@x.com'])
+        yield self.subscribe('buddies@x.com')
+        self.notifies()
+
+        yield self.presence.putResourceList('buddies@x.com', ['b@x.com'])
+        self.clock.advance(self.sip.LIST_NOTIFY_INTERVAL)
+        [body] = self.notifies()
+        self.assertTrue('version="1" fullState="true"' in body)
+        self.assertTrue('<resource uri="sip:b@x.com">' in body)
+        self.assertFalse('a@x.com' in body)
+
+        yield self.presence.putStatus('b@x.com', {'status': 'online'}, 600, tag='t')
+        yield self.presence.putStatus('a@x.com', {'status': 'online'}, 600, tag='t')
+        self.clock.advance(self.sip.LIST_NOTIFY_INTERVAL)
+        [body] = self.notifies()
+        self.assertTrue('version="2" fullState="false"' in body)
+        self.assertTrue('<resource uri="sip:b@x.com">' in body)
+        self.assertFalse('a@x.com' in body)
+
+    @defer.inlineCallbacks
+    def test_versionRestored(self):
+        yield self.presence.putResourceList('buddies@x.com', ['a@x.com'])
+        yield self.subscribe('buddies@x.com')
+        yield self.presence.putStatus('a@x.com', {'status': 'online'}, 600, tag='t')
+        self.clock.advance(self.sip.LIST_NOTIFY_INTERVAL)
+
+        presence = PresenceService(self.storage, self.clock)
+        sip = LoopbackSIPPresence(self.storage, presence, self.clock)
+        sip.dialog_store.dialogs = self.sip.dialog_store.dialogs
+        yield sip._loadSubscriptions()
+        [watcher] = sip.subscriptions
+        yield sip.notifyWatcher(watcher)
+        self.assertTrue('version="2" fullState="true"' in sip.requests[-1].content)
+
+    @defer.inlineCallbacks
+    def test_teardownWhileMembersChange(self):
+        storage = PausingStorage()
+        presence = PresenceService(storage, self.clock)
+        sip = LoopbackSIPPresence(storage, presence, self.clock)
+        yield presence.putResourceList('buddies@x.com', ['a@x.com'])
+        for i in xrange(2):
+            yield sip.handle_SUBSCRIBE(subscribe_request('buddies@x.com', 600))
+
+        storage.pause = True
+        d = presence.putResourceList('buddies@x.com', ['a@x.com', 'b@x.com'])
+        [(w, _)] = storage.paused
+        [kept] = [watcher for watcher in sip.subscriptions if ':'.join(watcher) == w]
+        [expired] = [watcher for watcher in sip.subscriptions if watcher != kept]
+        yield sip.expireWatchers([expired])
+        storage.resume()
+        yield d
+
+        self.assertEqual(sip.subscriptions.keys(), [kept])
+        for resource in ('a@x.com', 'b@x.com'):
+            r = yield storage.sgetall(sip.LIST_WATCHERS_SET_NAME % resource)
+            self.assertEqual(r, set([w]))
+
+PIDF = '''<?xml version="1.0" encoding="UTF-8"?>
+<presence xmlns="urn:ietf:params:xml:ns:pidf" entity="sip:%s">
+  <tuple id="t1"><status><basic>%s</basic></status></tuple>
+</presence>'''
+
+class PublishTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1000)
+        self.storage = MemoryStorage()
+        self.presence = PresenceService(self.storage, self.clock)
+        self.sip = LoopbackSIPPresence(self.storage, self.presence, self.clock)
+
+    @defer.inlineCallbacks
+    def publish(self, resource, basic, expires=600, tag=None):
+        pidf = basic and PIDF % (resource, basic)
+        yield self.sip.handle_PUBLISH(publish_request(resource, pidf, expires, tag))
+        defer.returnValue(self.sip.responses[-1])
+
+    @defer.inlineCallbacks
+    def test_modify(self):
+        response = yield self.publish('a@x.com', 'open')
+        etag = response.headers['SIP-ETag']
+        response = yield self.publish('a@x.com', 'closed', tag=etag)
+        self.assertEqual(response.headers['SIP-ETag'], etag)
+        [(tag, status)] = yield self.presence.getStatus('a@x.com')
+        self.assertEqual((tag, status['presence']), (etag, {'status': 'offline'}))
+
+    @defer.inlineCallbacks
+    def test_modifyUnknown(self):
+        yield self.assertFailure(self.publish('a@x.com', 'open', tag='unknown'), SIPError)
+        r = yield self.presence.getStatus('a@x.com')
+        self.assertEqual(r, [])
+
+    @defer.inlineCallbacks
+    def test_refreshAndRemove(self):
+        response = yield self.publish('a@x.com', 'open')
+        etag = response.headers['SIP-ETag']
+        yield self.publish('a@x.com', None, expires=3000, tag=etag)
+        [(_, status)] = yield self.presence.getStatus('a@x.com')
+        self.assertEqual(status['expiresat'], 4000)
+        yield self.publish('a@x.com', None, expires=0, tag=etag)
+        r = yield self.presence.getStatus('a@x.com')
+        self.assertEqual(r, [])
+
+    @defer.inlineCallbacks
+    def test_pidfCache(self):
+        yield self.publish('a@x.com', 'open')
+        yield self.publish('a@x.com', 'open')
+        yield self.publish('b@x.com', 'open')
+        cache = self.sip._pidf_cache
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        [(_, status)] = yield self.presence.getStatus('b@x.com')
+        self.assertEqual(status['presence'], {'status': 'online'})
+
+class SubscriptionExpiryTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1000)
+        self.storage = MemoryStorage()
+        self.presence = PresenceService(self.storage, self.clock)
+        self.sip = LoopbackSIPPresence(self.storage, self.presence, self.clock)
+        self.sip.WATCHER_EXPIRY_BATCH = 2
+
+    @defer.inlineCallbacks
+    def subscribe(self, n, expires=600):
+        for i in xrange(n):
+            yield self.sip.handle_SUBSCRIBE(subscribe_request('user%d@x.com' % i, expires))
+        defer.returnValue(sorted(self.sip.subscriptions))
+
+    def watchers(self, resource):
+        return self.storage.sgetall(self.sip.WATCHERS_SET_NAME % resource)
+
+    @defer.inlineCallbacks
+    def test_expireInBatches(self):
+        watchers = yield self.subscribe(5)
+        d = self.sip.expireWatchers(watchers)
+        self.assertEqual(len(self.sip.subscriptions), 3)
+        self.assertFalse(d.called)
+        self.clock.advance(0)
+        self.assertTrue(d.called)
+        yield d
+        self.assertEqual(self.sip.subscriptions, {})
+        self.assertEqual(self.sip.dialog_store.dialogs, {})
+
+    @defer.inlineCallbacks
+    def test_expiryErrors(self):
+        watchers = yield self.subscribe(3)
+        failing = watchers[1]
+        remove = self.sip.removeDialog
+        def removeDialog(id):
+            if id == failing:
+                raise RuntimeError("dialog store is down")
+            return remove(id)
+        self.sip.removeDialog = removeDialog
+        expired, errors = stats['sip_expired_watchers'], stats['sip_expiry_errors']
+        self.clock.advance(600)
+        self.assertEqual(stats['sip_expired_watchers'] - expired, 2)
+        self.assertEqual(stats['sip_expiry_errors'] - errors, 1)
+        self.assertEqual(len(self.flushLoggedErrors(defer.FirstError)), 1)
+
+    @defer.inlineCallbacks
+    def test_expire(self):
+        yield self.subscribe(5)
+        self.clock.advance(599)
+        self.assertEqual(len(self.sip.subscriptions), 5)
+        self.clock.advance(1)
+        self.assertEqual(self.sip.subscriptions, {})
+        self.assertEqual(self.sip.dialog_store.dialogs, {})
+        yield self.assertFailure(self.storage.hgetall(self.sip.SUBSCRIPTIONS), KeyError)
+        yield self.assertFailure(self.watchers('user0@x.com'), KeyError)
+
+    @defer.inlineCallbacks
+    def test_refreshDuringExpiry(self):
+        watchers = yield self.subscribe(4)
+        d = self.sip.expireWatchers(watchers)
+        refreshed = watchers[3]
+        dialog = self.sip.dialog_store.dialogs[refreshed]
+        yield self.sip.handle_SUBSCRIBE(subscribe_request('user3@x.com', 1200, dialog=dialog))
+        self.clock.advance(0)
+        yield d
+        self.assertEqual(self.sip.subscriptions.keys(), [refreshed])
+        self.assertEqual(self.sip.dialog_store.dialogs.keys(), [refreshed])
+        self.clock.advance(1200)
+        self.assertEqual(self.sip.subscriptions, {})
+
+    @defer.inlineCallbacks
+    def test_expiredAtLoad(self):
+        expired, active = ('call1', 'from', 'to'), ('call2', 'from', 'to')
+        for watcher, expiresat in ((expired, 900), (active, 1600)):
+            w = ':'.join(watcher)
+            yield self.storage.hset(self.sip.SUBSCRIPTIONS, w, pack_subscription(expiresat, 'a@x.com'))
+            yield self.storage.sadd(self.sip.WATCHERS_SET_NAME % 'a@x.com', w)
+            self.sip.dialog_store.dialogs[watcher] = None
+        yield self.sip._loadSubscriptions()
+        self.clock.advance(0)
+        self.assertEqual(self.sip.subscriptions.keys(), [active])
+        self.assertEqual(self.sip.dialog_store.dialogs.keys(), [active])
+        r = yield self.watchers('a@x.com')
+        self.assertEqual(r, set(['call2:from:to']))
+        r = yield self.storage.hgetall(self.sip.SUBSCRIPTIONS)
+        self.assertEqual(r.keys(), ['call2:from:to'])
+
+    @defer.inlineCallbacks
+    def test_convertLegacySubscriptions(self):
+        yield self.storage.hset(self.sip.WATCHER_TIMERS, 'call1:from:to', '1600.5')
+        yield self.storage.hset(self.sip.RESOURCE_BY_WATCHER, 'call1:from:to', 'a@x.com')
+        yield self.storage.hset(self.sip.WATCHER_TIMERS, 'call2:from:to', '1700')
+        yield self.storage.hset(self.sip.LIST_BY_WATCHER, 'call2:from:to', 'buddies@x.com')
+        yield self.sip._loadSubscriptions()
+        self.assertEqual(self.sip.subscriptions, {
+            ('call1', 'from', 'to'): (1601.0, 'a@x.com', False),
+            ('call2', 'from', 'to'): (1700.0, 'buddies@x.com', True),
+            })
+        r = yield self.storage.hgetall(self.sip.SUBSCRIPTIONS)
+        self.assertEqual(r, {'call1:from:to': '1601 r a@x.com', 'call2:from:to': '1700 l buddies@x.com'})
+        for key in (self.sip.WATCHER_TIMERS, self.sip.RESOURCE_BY_WATCHER, self.sip.LIST_BY_WATCHER):
+            yield self.assertFailure(self.storage.hgetall(key), KeyError)
@@ -0,0 +1,85 @@
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from tipsip import MemoryStorage
+from tippresence import PresenceService, PresenceServiceError
+from tippresence.subscriber import Subscriber
+
+class SubscriberTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.pending = []
+
+    def slowCallback(self, resource, status):
+        d = defer.Deferred()
+        self.calls.append((resource, status))
+        self.pending.append(d)
+        return d
+
+    def test_coalesce(self):
+        s = Subscriber('test', self.slowCallback, overflow=Subscriber.COALESCE)
+        s.put('ivaxer@tipmeet.com', 1)
+        s.put('john@tipmeet.com', 1)
+        s.put('john@tipmeet.com', 2)
+        self.assertEqual(s.depth(), 1)
+        self.assertEqual(s.counters['coalesced'], 1)
+        self.pending.pop(0).callback(None)
+        self.assertEqual(self.calls, [('ivaxer@tipmeet.com', 1), ('john@tipmeet.com', 2)])
+        self.pending.pop(0).callback(None)
+        self.assertEqual(s.counters['delivered'], 2)
+
+    def test_coalesceKeepsEveryResource(self):
+        s = Subscriber('test', self.slowCallback, maxsize=2, overflow=Subscriber.COALESCE)
+        for r in ('a', 'b', 'c', 'd', 'b'):
+            s.put(r, None)
+        self.assertEqual(s.depth(), 3)
+        self.assertEqual(s.counters['dropped'], 0)
+        while self.pending:
+            self.pending.pop(0).callback(None)
+        self.assertEqual([r for r, _ in self.calls], ['a', 'b', 'c', 'd'])
+
+    def test_dropOldest(self):
+        s = Subscriber('test', self.slowCallback, maxsize=2, overflow=Subscriber.DROP_OLDEST)
+        for i in range(4):
+            s.put('ivaxer@tipmeet.com', i)
+        self.assertEqual(s.depth(), 2)
+        self.assertEqual(s.counters['dropped'], 1)
+        while self.pending:
+            self.pending.pop(0).callback(None)
+        self.assertEqual([x for _, x in self.calls], [0, 2, 3])
+
+    def test_concurrency(self):
+        s = Subscriber('test', self.slowCallback, concurrency=2)
+        for r in ('a', 'b', 'c'):
+            s.put(r, None)
+        self.assertEqual(s.running, 2)
+        self.assertEqual(s.depth(), 1)
+        self.pending.pop(0).callback(None)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_errors(self):
+        def failing(resource, status):
+            raise RuntimeError("boom")
+        s = Subscriber('test', failing)
+        s.put('ivaxer@tipmeet.com', None)
+        self.assertEqual(s.counters['errors'], 1)
+        self.assertEqual(s.running, 0)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+    @defer.inlineCallbacks
+    def test_watch(self):
+        presence = PresenceService(MemoryStorage())
+        presence.watch(lambda r, s, x: self.calls.append((r, x)), 'arg')
+        yield presence.putStatus('ivaxer@tipmeet.com', {"status": "online"}, expires=3600, tag='t')
+        yield presence.removeStatus('ivaxer@tipmeet.com', 't')
+        self.assertEqual(self.calls, [('ivaxer@tipmeet.com', 'arg')] * 2)
+        self.assertEqual(presence.dumpSubscribers()['<lambda>']['delivered'], 2)
+
+    def test_subscriberNames(self):
+        presence = PresenceService(MemoryStorage())
+        presence.watch(lambda r, s: None)
+        presence.watch(lambda r, s: None)
+        presence.subscribe(lambda r, s: None, name='sip')
+        self.assertEqual(sorted(presence.dumpSubscribers()), ['<lambda>', '<lambda>#2', 'sip'])
+        self.assertRaises(PresenceServiceError, presence.subscribe, lambda r, s: None, name='sip')
+
@@ -0,0 +1,14 @@
+from twisted.trial import unittest
+
+from tippresence.sip.presence import pack_subscription, unpack_subscription
+
+class SubscriptionRecordTest(unittest.TestCase):
+    def test_packSubscription(self):
+        record = pack_subscription(1300000000.25, 'ivaxer@tipmeet.com')
+        self.assertEqual(record, '1300000001 r ivaxer@tipmeet.com')
+        self.assertEqual(unpack_subscription(record), (1300000001.0, 'ivaxer@tipmeet.com', False))
+
+    def test_packListSubscription(self):
+        record = pack_subscription(60, 'buddies@tipmeet.com', is_list=True)
+        self.assertEqual(record, '60 l buddies@tipmeet.com')
+        self.assertEqual(unpack_subscription(record), (60.0, 'buddies@tipmeet.com', True))
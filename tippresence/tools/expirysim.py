@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Simulation of registrations and expirations on VirtualClock: every
+resource publishes status at random moment of the first hour, part of
+them keep refreshing it, the rest expire.
+
+    python -O -m tippresence.tools.expirysim [-n resources] [-H hours] [-r refreshing]
+
+Run it with -O: per-operation debug logging of PresenceService is
+compiled out then. Every operation goes through the real PresenceService
+code (storage calls, watcher notification, timers), which costs about
+0.2 ms of CPU per operation: 20000 resources over 3 hours (75000
+operations) take about 15 s. Simulated time is free, so hours of
+expirations run without waiting, but millions of operations take
+minutes.
+"""
+
+import json
+import random
+import time
+from optparse import OptionParser
+
+from tipsip import MemoryStorage
+
+from tippresence import PresenceService
+from tippresence import stats
+from tippresence.clock import VirtualClock
+
+class ExpirySimulation(object):
+    MIN_EXPIRES = 600
+    MAX_EXPIRES = 3600
+
+    def __init__(self, resources, hours, refreshing=0.5, seed=None):
+        self.clock = VirtualClock()
+        self.presence = PresenceService(MemoryStorage(), self.clock)
+        self.resources = resources
+        self.end = hours * 3600
+        self.refreshing = refreshing
+        self.random = random.Random(seed)
+        self.operations = 0
+        self.peak_timers = 0
+
+    def run(self):
+        removed = stats['presence_removed_statuses']
+        self._timers = stats['presence_active_timers']
+        started_at = time.time()
+        for i in xrange(self.resources):
+            refresh = self.random.random() < self.refreshing
+            self.clock.callLater(self.random.uniform(0, 3600), self._publish, 'user%d@domain%d' % (i, i % 100), refresh)
+        self.clock.callLater(60, self._sample)
+        self.clock.run(until=self.end)
+        wall = time.time() - started_at
+        return {
+                'resources': self.resources,
+                'simulated_seconds': self.clock.seconds(),
+                'wall_seconds': wall,
+                'operations': self.operations,
+                'expired': stats['presence_removed_statuses'] - removed,
+                'peak_timers': self.peak_timers,
+                'active_timers': stats['presence_active_timers'] - self._timers,
+                }
+
+    def _publish(self, resource, refresh):
+        expires = self.random.randint(self.MIN_EXPIRES, self.MAX_EXPIRES)
+        self.operations += 1
+        d = self.presence.putStatus(resource, {'status': 'online'}, expires, tag='t')
+        if refresh:
+            d.addCallback(lambda tag: self._scheduleRefresh(resource, expires))
+
+    def _refresh(self, resource, expires):
+        self.operations += 1
+        d = self.presence.updateStatus(resource, 't', expires)
+        d.addCallback(lambda _: self._scheduleRefresh(resource, expires))
+
+    def _scheduleRefresh(self, resource, expires):
+        if self.clock.seconds() + expires * 0.9 < self.end:
+            self.clock.callLater(expires * 0.9, self._refresh, resource, expires)
+
+    def _sample(self):
+        self.peak_timers = max(self.peak_timers, stats['presence_active_timers'] - self._timers)
+        self.clock.callLater(60, self._sample)
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('-n', '--resources', type='int', default=100000, help="number of resources")
+    parser.add_option('-H', '--hours', type='float', default=2, help="simulated hours")
+    parser.add_option('-r', '--refreshing', type='float', default=0.5, help="share of refreshing resources")
+    parser.add_option('-s', '--seed', type='int', help="random seed")
+    options, args = parser.parse_args()
+    sim = ExpirySimulation(options.resources, options.hours, options.refreshing, options.seed)
+    print json.dumps(sim.run(), indent=4)
+
+if __name__ == '__main__':
+    main()
+
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of PIDF ingestion: regex matching used by SIPPresence
+before tippresence.pidf versus parse_pidf and PIDFCache.
+
+    python -m tippresence.tools.pidfbench [iterations]
+"""
+
+import re
+import sys
+from timeit import Timer
+
+from tippresence.pidf import parse_pidf, PIDFCache
+
+PIDF = '''<?xml version="1.0" encoding="UTF-8"?>
+<presence xmlns="urn:ietf:params:xml:ns:pidf"
+    xmlns:dm="urn:ietf:params:xml:ns:pidf:data-model"
+    xmlns:rpid="urn:ietf:params:xml:ns:pidf:rpid"
+    entity="sip:ivaxer@tipmeet.com">
+  <tuple id="t8a7ffd">
+    <status>
+      <basic>closed</basic>
+    </status>
+    <contact priority="0.5">sip:ivaxer@10.0.0.1</contact>
+  </tuple>
+  <tuple id="t5fa9e1">
+    <status>
+      <basic>open</basic>
+    </status>
+    <contact priority="0.8">sip:ivaxer@10.0.0.2</contact>
+    <note>Working from home</note>
+  </tuple>
+  <dm:person id="p1">
+    <rpid:activities>
+      <rpid:on-the-phone/>
+    </rpid:activities>
+  </dm:person>
+</presence>
+'''
+
+online_re = re.compile('.*<status><basic>open</basic></status>.*')
+
+def regex_path(pidf):
+    pidf = ''.join(pidf.split())
+    if online_re.match(pidf):
+        return {'status': 'online'}
+    return {'status': 'offline'}
+
+cached_path = PIDFCache().parse
+
+def bench(name, func, pidf, number):
+    # every call gets fresh copy of document like body of received request
+    head, tail = pidf[:-1], pidf[-1]
+    t = min(Timer(lambda: func(head + tail)).repeat(3, number))
+    print '%-24s %8.2f us/op' % (name, t / number * 1e6)
+
+def main(number=10000):
+    padded = PIDF.replace('</presence>', '<!--%s-->\n</presence>' % (' ' * 16384))
+    for title, pidf in (('typical', PIDF), ('16K comment', padded)):
+        print '%s document (%d bytes):' % (title, len(pidf))
+        bench('regex', regex_path, pidf, number)
+        bench('parse_pidf', parse_pidf, pidf, number)
+        bench('parse_pidf (cached)', cached_path, pidf, number)
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
+
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Replay capture of presence operations (see tippresence.capture) against
+in-process PresenceService and SIPPresence (without network, see
+tippresence.sip.loopback) and report throughput and latency.
+
+    python -m tippresence.tools.replay [--speed N] [--virtual] capture.tpcap
+
+With --virtual operations are issued as fast as possible while virtual
+clock follows timestamps of the capture, otherwise capture is replayed
+in real time accelerated --speed times.
+"""
+
+import json
+import time
+from collections import defaultdict
+from optparse import OptionParser
+
+from twisted.internet import reactor, defer
+from twisted.python import log
+
+from tipsip import MemoryStorage
+
+from tippresence import PresenceService
+from tippresence import capture
+from tippresence.clock import VirtualClock
+from tippresence.sip.loopback import LoopbackSIPPresence, subscribe_request
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+class Replayer(object):
+    """
+    SIP requests are processed by LoopbackSIPPresence sharing storage and
+    clock with presence service. Dialogs and entity tags of the capture
+    are mapped to ones created during replay.
+    """
+    def __init__(self, presence_service, clock=reactor, speed=1.0, sip=None):
+        self.presence_service = presence_service
+        self.clock = clock
+        self.speed = speed
+        if sip is None:
+            sip = LoopbackSIPPresence(presence_service.storage, presence_service, clock, history=False)
+        self.sip = sip
+        self.dialogs = {}
+        self.etags = {}
+        self.latency = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._in_flight = 0
+        self._records = None
+        self._finished = None
+
+    def replay(self, records):
+        """
+        Replay records, returns deferred fired with report when all
+        operations are completed.
+        """
+        self._records = iter(records)
+        self._finished = defer.Deferred()
+        self._first_ts = None
+        self._started_at = self.clock.seconds()
+        self._sent_requests = self.sip.sent_requests
+        self._wall_started_at = time.time()
+        self._issueRecords()
+        return self._finished
+
+    def runVirtual(self, records):
+        """
+        Replay records on VirtualClock: advance clock to every scheduled
+        record or timer of presence service sharing the clock without waiting.
+        """
+        d = self.replay(records)
+        self.clock.run()
+        return d
+
+    def report(self):
+        wall = time.time() - self._wall_started_at
+        total = sum(len(x) for x in self.latency.itervalues())
+        r = {
+                'operations': total,
+                'notifies': self.sip.sent_requests - self._sent_requests,
+                'wall_seconds': wall,
+                'capture_seconds': (self.clock.seconds() - self._started_at) * self.speed,
+                'throughput': total / wall if wall else None,
+                'events': {},
+                }
+        for event, latency in self.latency.iteritems():
+            r['events'][capture.EVENT_NAMES[event]] = {
+                    'count': len(latency),
+                    'errors': self.errors[event],
+                    'p50_ms': percentile(latency, 0.5) * 1000,
+                    'p99_ms': percentile(latency, 0.99) * 1000,
+                    'max_ms': max(latency) * 1000,
+                    }
+        return r
+
+    def _issueRecords(self):
+        for ts, event, fields in self._records:
+            if self._first_ts is None:
+                self._first_ts = ts
+            delay = (ts - self._first_ts) / self.speed - (self.clock.seconds() - self._started_at)
+            if delay > 0:
+                self.clock.callLater(delay, self._issueDelayed, event, fields)
+                return
+            self._issue(event, fields)
+        self._records = None
+        self._checkFinished()
+
+    def _issueDelayed(self, event, fields):
+        self._issue(event, fields)
+        self._issueRecords()
+
+    def _issue(self, event, fields):
+        started_at = time.time()
+        self._in_flight += 1
+        d = defer.maybeDeferred(self._apply, event, *fields)
+        d.addErrback(self._failed, event)
+        d.addBoth(self._completed, event, started_at)
+
+    def _apply(self, event, *fields):
+        p = self.presence_service
+        if event == capture.HTTP_PUT:
+            resource, tag, pdoc, expires, priority = fields
+            return p.putStatus(resource, pdoc, expires, priority=priority, tag=tag)
+        elif event == capture.HTTP_REMOVE:
+            resource, tag = fields
+            return p.removeStatus(resource, tag)
+        elif event == capture.HTTP_GET:
+            return p.getStatus(*fields)
+        elif event == capture.HTTP_DUMP:
+            return p.dumpStatuses()
+        elif event == capture.SIP_PUBLISH:
+            return self._publish(*fields)
+        elif event == capture.SIP_SUBSCRIBE:
+            return self._subscribe(*fields)
+        elif event == capture.HTTP_PUT_LIST:
+            return p.putResourceList(*fields)
+        elif event == capture.HTTP_REMOVE_LIST:
+            return p.removeResourceList(*fields)
+        raise capture.CaptureError("Unknown event: %r" % event)
+
+    @defer.inlineCallbacks
+    def _publish(self, resource, tag, etag, expires, pidf):
+        if tag:
+            tag = self.etags.get(tag, tag)
+        r = yield self.sip.publish(resource, pidf, expires, tag)
+        if expires == 0:
+            self.etags.pop(etag, None)
+        elif r and etag:
+            self.etags[etag] = r
+
+    @defer.inlineCallbacks
+    def _subscribe(self, watcher, resource, expires):
+        if resource:
+            subscribe = subscribe_request(resource, expires)
+            yield self.sip.processSubscription(subscribe)
+            if subscribe.dialog:
+                self.dialogs[watcher] = subscribe.dialog
+        elif watcher in self.dialogs:
+            dialog = self.dialogs[watcher] if expires else self.dialogs.pop(watcher)
+            yield self.sip.processSubscription(subscribe_request(None, expires, dialog=dialog))
+
+    def _failed(self, failure, event):
+        self.errors[event] += 1
+        log.msg("Replay of %s failed: %s" % (capture.EVENT_NAMES.get(event), failure.getErrorMessage()))
+
+    def _completed(self, r, event, started_at):
+        self.latency[event].append(time.time() - started_at)
+        self._in_flight -= 1
+        self._checkFinished()
+
+    def _checkFinished(self):
+        if self._records is None and not self._in_flight and not self._finished.called:
+            self._finished.callback(self.report())
+
+def main():
+    parser = OptionParser(usage="%prog [options] capture")
+    parser.add_option('-s', '--speed', type='float', default=1.0, help="replay speed factor")
+    parser.add_option('-v', '--virtual', action='store_true', help="replay on virtual clock")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("capture file required")
+    records = capture.read_capture(args[0])
+
+    def print_report(report):
+        print json.dumps(report, indent=4)
+
+    if options.virtual:
+        clock = VirtualClock()
+        replayer = Replayer(PresenceService(MemoryStorage(), clock), clock, options.speed)
+        replayer.runVirtual(records).addCallback(print_report)
+    else:
+        replayer = Replayer(PresenceService(MemoryStorage()), reactor, options.speed)
+        d = replayer.replay(records)
+        d.addCallback(print_report)
+        d.addBoth(lambda _: reactor.stop())
+        reactor.run()
+
+if __name__ == '__main__':
+    main()
+
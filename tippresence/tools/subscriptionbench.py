@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Cost of SIP subscriptions on MemoryStorage and VirtualClock: watchers
+subscribe, refresh and finally expire. Reports storage operations per
+watcher for every phase, in-process and storage memory per subscription
+and number of pending timers.
+
+    python -O -m tippresence.tools.subscriptionbench [-n watchers] [-e expires]
+"""
+
+import json
+import time
+from collections import defaultdict
+from optparse import OptionParser
+
+from tipsip import MemoryStorage
+
+from tippresence import PresenceService
+from tippresence.clock import VirtualClock
+from tippresence.introspection import approx_size
+from tippresence.sip.loopback import LoopbackSIPPresence
+
+class CountingStorage(object):
+    """
+    Storage proxy counting calls of storage commands.
+    """
+    COMMANDS = ('hset', 'hget', 'hgetall', 'hdel', 'sadd', 'srem', 'sgetall')
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.ops = defaultdict(int)
+
+    def __getattr__(self, name):
+        f = getattr(self.storage, name)
+        if name not in self.COMMANDS:
+            return f
+        def counted(*args, **kwargs):
+            self.ops[name] += 1
+            return f(*args, **kwargs)
+        return counted
+
+    def total(self):
+        return sum(self.ops.itervalues())
+
+class SubscriptionBenchmark(object):
+    RESOURCES = 100
+
+    def __init__(self, watchers, expires=3600):
+        self.clock = VirtualClock()
+        self.storage = CountingStorage(MemoryStorage())
+        presence = PresenceService(MemoryStorage(), self.clock)
+        self.sip = LoopbackSIPPresence(self.storage, presence, self.clock, history=False)
+        self.watchers = [('call%d' % i, 'from%d' % i, 'to%d' % i) for i in xrange(watchers)]
+        self.expires = expires
+
+    def run(self):
+        r = {'watchers': len(self.watchers)}
+        r['subscribe'] = self._phase(self._subscribe)
+        r['memory_per_subscription'] = self._memory() / len(self.watchers)
+        r['storage_per_subscription'] = self._storageMemory() / len(self.watchers)
+        r['pending_timers'] = len(self.clock.getDelayedCalls())
+        r['refresh'] = self._phase(self._refresh)
+        r['expire'] = self._phase(self._expire)
+        r['dialogs_left'] = len(self.sip.dialog_store.dialogs)
+        r['subscriptions_left'] = len(self.sip.subscriptions)
+        return r
+
+    def _phase(self, f):
+        self.storage.ops.clear()
+        started_at = time.time()
+        f()
+        return {
+                'wall_seconds': time.time() - started_at,
+                'storage_ops_per_watcher': self.storage.total() / float(len(self.watchers)),
+                'storage_ops': dict(self.storage.ops),
+                }
+
+    def _subscribe(self):
+        dialogs = self.sip.dialog_store.dialogs
+        for i, watcher in enumerate(self.watchers):
+            dialogs[watcher] = None
+            self.sip.addWatcher(watcher, 'user%d@domain' % (i % self.RESOURCES), self.expires)
+
+    def _refresh(self):
+        self.clock.advance(self.expires / 2)
+        for watcher in self.watchers:
+            self.sip.updateWatcher(watcher, self.expires)
+
+    def _expire(self):
+        self.clock.run()
+
+    def _memory(self):
+        sip = self.sip
+        state = [sip.subscriptions, sip._expiry_buckets, sip._expiry_tid, self.clock._calls]
+        return sum(approx_size(x, 3) for x in state)
+
+    def _storageMemory(self):
+        return sum(approx_size(value, 3) for value in vars(self.storage.storage).itervalues()
+                if isinstance(value, dict))
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('-n', '--watchers', type='int', default=10000, help="number of watchers")
+    parser.add_option('-e', '--expires', type='int', default=3600, help="subscription expiration time")
+    options, args = parser.parse_args()
+    bench = SubscriptionBenchmark(options.watchers, options.expires)
+    print json.dumps(bench.run(), indent=4)
+
+if __name__ == '__main__':
+    main()